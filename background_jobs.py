@@ -0,0 +1,177 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+
+def run_task(fn, args=(), kwargs=None):
+    """在工作进程中执行一个任务，返回错误信息，成功时返回None"""
+    try:
+        fn(*args, **(kwargs or {}))
+        return None
+    except Exception as e:
+        return str(e)
+
+class Job:
+    """一个后台作业（例如转换一个目录），由若干个独立任务组成"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, make_tasks):
+        self.id = next(self._ids)
+        self.name = name
+        self.make_tasks = make_tasks
+        self.cancel_event = threading.Event()
+        self.total = None
+        self.done = 0
+        self.errors = 0
+        self.started = None
+        self.error = None
+        self.cancelled = False
+
+    @property
+    def rate(self):
+        """每秒完成的任务数"""
+        if not self.started or not self.done:
+            return 0.0
+        return self.done / max(time.monotonic() - self.started, 1e-6)
+
+    @property
+    def eta(self):
+        """预计剩余秒数，无法估计时返回None"""
+        if self.total is None or not self.rate:
+            return None
+        return (self.total - self.done) / self.rate
+
+class JobEngine:
+    """
+    图形界面的后台作业引擎
+
+    作业按提交顺序排队，依次在常驻的进程池中执行：每个作业由一个后台线程列出任务并提交到进程池
+    （同时在进程池中的任务数有上限，便于及时取消），结果通过队列传回，由 Tk 主线程用 root.after
+    轮询处理，界面始终不会阻塞。
+
+    on_event(event, job, *details) 在主线程中调用，event 为:
+        'queued'   - 作业加入队列
+        'started'  - 作业开始执行
+        'total'    - 任务总数已知，details 为 (总数,)
+        'result'   - 一个任务完成，details 为 (任务名称, 错误信息或None)
+        'finished' - 作业结束（完成、取消或列出任务失败，失败原因见 job.error）
+    """
+
+    def __init__(self, root, on_event, workers=None, poll_ms=100):
+        self.root = root
+        self.on_event = on_event
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_ms = poll_ms
+        self.events = queue.Queue()
+        self.pending_jobs = deque()
+        self.current = None
+        self._executor = None
+        self._closed = False
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, name, make_tasks):
+        """
+        提交作业
+
+        make_tasks 在后台线程中调用，返回可迭代的任务 (名称, 函数, 参数元组[, 关键字参数])，
+        函数和参数需要能传给子进程（模块级函数）。
+        """
+        job = Job(name, make_tasks)
+        self.pending_jobs.append(job)
+        self.on_event('queued', job)
+        self._start_next()
+        return job
+
+    def cancel(self, job=None):
+        """取消作业（默认为当前作业）：排队中的直接移除，执行中的不再提交新任务"""
+        job = job or self.current
+        if job is None:
+            return
+        job.cancelled = True
+        job.cancel_event.set()
+        if job in self.pending_jobs:
+            self.pending_jobs.remove(job)
+            self.on_event('finished', job)
+
+    def shutdown(self):
+        """取消所有作业并关闭进程池（等待正在执行的少量任务结束）"""
+        self._closed = True
+        for job in list(self.pending_jobs):
+            self.cancel(job)
+        if self.current:
+            self.cancel(self.current)
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def busy(self):
+        return self.current is not None or bool(self.pending_jobs)
+
+    def _start_next(self):
+        if self.current is not None or not self.pending_jobs or self._closed:
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.current = self.pending_jobs.popleft()
+        self.current.started = time.monotonic()
+        self.on_event('started', self.current)
+        threading.Thread(target=self._feed, args=(self.current,), daemon=True).start()
+
+    def _feed(self, job):
+        """后台线程：列出任务并提交到进程池，等待全部完成"""
+        futures = []
+        try:
+            tasks = list(job.make_tasks())
+            self.events.put(('total', job, len(tasks)))
+
+            # 限制同时在进程池中的任务数，取消时只需等待少量任务完成
+            slots = threading.Semaphore(self.workers * 2)
+            for name, fn, *arguments in tasks:
+                while not slots.acquire(timeout=0.1):
+                    if job.cancel_event.is_set():
+                        break
+                if job.cancel_event.is_set():
+                    break
+                future = self._executor.submit(run_task, fn, *arguments)
+                future.add_done_callback(lambda f, name=name: self._task_done(job, name, f, slots))
+                futures.append(future)
+        except Exception as e:
+            job.error = str(e)
+        wait(futures)
+        self.events.put(('finished', job))
+
+    def _task_done(self, job, name, future, slots):
+        slots.release()
+        if future.cancelled():
+            return
+        try:
+            error = future.result()
+        except Exception as e:
+            # 工作进程异常退出等情况
+            error = str(e)
+        self.events.put(('result', job, name, error))
+
+    def _poll(self):
+        """主线程：处理后台传回的事件"""
+        try:
+            while True:
+                event, job, *details = self.events.get_nowait()
+                if event == 'total':
+                    job.total = details[0]
+                elif event == 'result':
+                    job.done += 1
+                    if details[1] is not None:
+                        job.errors += 1
+                elif event == 'finished':
+                    self.current = None
+                self.on_event(event, job, *details)
+                if event == 'finished':
+                    self._start_next()
+        except queue.Empty:
+            pass
+        if not self._closed:
+            self.root.after(self.poll_ms, self._poll)
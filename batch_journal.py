@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from conversion_metrics import ConversionRecord, OutputRecord
+from webp_encoder import write_atomic
+
+# 索引格式版本，条目结构变化时递增以使旧索引失效
+JOURNAL_VERSION = 1
+# 累计这么多条未写入磁盘的记录，或距上次写入超过这么多秒时执行一次 fsync
+SYNC_EVERY = 64
+SYNC_INTERVAL = 1.0
+# 日志中的记录超过这么多条时压缩到索引
+COMPACT_EVERY = 10000
+
+class BatchJournal:
+    """
+    批量转换日志，中断后再次运行时跳过已完成的文件
+
+    每个转换成功的文件在日志末尾追加一行JSON：源文件路径、大小和修改时间、参数指纹，
+    以及各输出的路径、质量、编码方式和大小。
+    每行写入后立即交给操作系统（进程被结束也不会丢失），每 sync_every 条或每 sync_interval 秒才 fsync 一次，
+    断电时最多丢失最近一批记录，这些文件下次重新转换。
+    打开时先读取索引（<日志文件名>.index），再按顺序重放日志，中断时写了一半的最后一行被截掉。
+    日志超过 compact_every 条记录时以及关闭时压缩：索引写入磁盘后原子替换，再清空日志
+    （替换后、清空前中断时，重放的记录与索引中的相同，不影响结果）。
+    同一个日志同时只能由一个批量转换使用。
+    """
+
+    def __init__(self, path, params, sync_every=SYNC_EVERY, sync_interval=SYNC_INTERVAL, compact_every=COMPACT_EVERY):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.index')
+        self.fingerprint = params_fingerprint(params)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.entries = {}
+        self.logged = 0
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        try:
+            self._load()
+            self.file = open(self.path, 'a', encoding='utf-8')
+        except OSError as e:
+            raise Exception(f"无法打开转换日志 {path}: {str(e)}")
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == JOURNAL_VERSION:
+                self.entries = index['entries']
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            # 索引是原子替换的，不会只写了一部分；无法解析时忽略，文件重新转换
+            pass
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.path, 'rb+') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    # 截掉写了一半的最后一行，之后追加的记录从新的一行开始
+                    f.truncate(end)
+        except FileNotFoundError:
+            return
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+                self.entries[entry['source']] = entry
+            except (ValueError, KeyError, TypeError):
+                continue
+            self.logged += 1
+
+    def completed(self, source, source_stat, output_files):
+        """
+        查询文件是否已完成转换
+
+        源文件（source_stat 为 source_stat() 的结果）、参数和输出路径都与日志中的记录相同，
+        并且输出文件仍然存在、大小不变时，返回由日志恢复的转换记录（resumed 为True），否则返回None。
+        """
+        entry = self.entries.get(_key(source))
+        if (entry is None or source_stat is None or entry['params'] != self.fingerprint
+                or (entry['size'], entry['mtime_ns']) != source_stat
+                or [output['path'] for output in entry['outputs']] != [_key(path) for path in output_files]):
+            return None
+        for output in entry['outputs']:
+            try:
+                if os.path.getsize(output['path']) != output['bytes_out']:
+                    return None
+            except OSError:
+                return None
+
+        record = ConversionRecord(str(source), bytes_in=entry['size'], resumed=True)
+        for output in entry['outputs']:
+            record.outputs.append(OutputRecord(output['variant'], output['path'], quality=output['quality'],
+                                               bytes_out=output['bytes_out'],
+                                               encoding=output.get('encoding', 'lossy')))
+        return record
+
+    def record(self, record, source_stat):
+        """记录一个转换成功的文件，source_stat 为提交转换前的 source_stat() 结果"""
+        if record.error or source_stat is None:
+            return
+        entry = {
+            'source': _key(record.source),
+            'size': source_stat[0],
+            'mtime_ns': source_stat[1],
+            'params': self.fingerprint,
+            'outputs': [{'variant': output.variant, 'path': _key(output.path), 'quality': output.quality,
+                         'encoding': output.encoding, 'bytes_out': output.bytes_out} for output in record.outputs],
+            'finished': time.time(),
+        }
+        self.entries[entry['source']] = entry
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+        self.logged += 1
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+        if self.logged >= self.compact_every:
+            self.compact()
+
+    def sync(self):
+        """把已写入的记录写入磁盘"""
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def compact(self):
+        """把全部记录写入索引，然后清空日志"""
+        self.sync()
+        index = {'version': JOURNAL_VERSION, 'entries': self.entries}
+        write_atomic(self.index_path, json.dumps(index, ensure_ascii=False).encode('utf-8'), fsync=True)
+        self.file.seek(0)
+        self.file.truncate()
+        self.logged = 0
+
+    def close(self):
+        try:
+            if self.logged:
+                self.compact()
+            else:
+                self.sync()
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def source_stat(path):
+    """源文件的 (大小, 修改时间ns)，用于判断文件是否变化，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def params_fingerprint(params):
+    """影响输出的转换参数的指纹，参数变化后日志中的记录不再视为已完成"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def _key(path):
+    return os.path.abspath(path)
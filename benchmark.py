@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import io
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+import PIL
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不统计内存峰值
+    resource = None
+
+# 合成图片的种类
+KINDS = ('photo', 'ui', 'rgba_opaque', 'rgba_alpha')
+# 默认的图片尺寸
+DEFAULT_SIZES = ('960x540', '1920x1080')
+# perceptual 测试项的目标SSIM
+PERCEPTUAL_TARGET = 0.98
+# 可运行的测试项
+CASES = ('convert', 'cropped', 'search', 'perceptual', 'auto', 'batch', 'merge')
+
+def generate_image(kind, size, seed):
+    """
+    生成一张合成图片（同样的参数总是得到同样的图片）
+
+    photo: 平滑的色块加细噪声，类似照片；ui: 纯色背景、面板和文字状的细线，类似界面截图；
+    rgba_opaque: 界面截图加全不透明的透明通道；rgba_alpha: 照片加渐变的透明通道
+    """
+    rng = random.Random(f"{kind}:{size}:{seed}")
+    width, height = size
+    if kind in ('photo', 'rgba_alpha'):
+        # 低分辨率随机色块放大后模糊，再叠加细噪声
+        base = Image.frombytes('RGB', (16, 9), rng.randbytes(16 * 9 * 3))
+        img = base.resize(size, Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(width / 200))
+        noise = Image.frombytes('L', size, rng.randbytes(width * height)).convert('RGB')
+        img = Image.blend(img, noise, 0.08)
+    else:
+        img = Image.new('RGB', size, (245, 246, 248))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            left, top = rng.randrange(width), rng.randrange(height)
+            right, bottom = left + rng.randrange(width // 3), top + rng.randrange(height // 3)
+            draw.rectangle((left, top, right, bottom), fill=tuple(rng.randrange(256) for _ in range(3)))
+        # 文字状的细线
+        for y in range(0, height, max(8, height // 60)):
+            x = rng.randrange(width // 4)
+            draw.line((x, y, x + rng.randrange(width // 2), y), fill=(40, 40, 40), width=2)
+
+    if kind == 'rgba_opaque':
+        img = img.convert('RGBA')
+    elif kind == 'rgba_alpha':
+        img.putalpha(Image.linear_gradient('L').resize(size))
+    return img
+
+def generate_corpus(corpus_dir, sizes, count=1):
+    """在 corpus_dir 中生成每种图片、每种尺寸各 count 张PNG，返回文件列表"""
+    corpus_dir = Path(corpus_dir)
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for width, height in sizes:
+        for kind in KINDS:
+            for seed in range(count):
+                path = corpus_dir / f"{kind}_{width}x{height}_{seed}.png"
+                if not path.exists():
+                    generate_image(kind, (width, height), seed).save(path)
+                files.append(path)
+    return files
+
+def parse_size(text):
+    try:
+        width, height = (int(value) for value in text.lower().split('x'))
+        return width, height
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"尺寸格式应为 宽x高: {text}")
+
+def peak_rss_mb():
+    """当前进程及其子进程的内存峰值（MB），无法统计时返回None"""
+    if resource is None:
+        return None
+    # Linux 单位为KB，macOS 为字节
+    unit = 1 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak * unit / 1024 / 1024, 1)
+
+def run_case(case, files, output_dir, repeat, workers):
+    """
+    运行一个测试项（在独立的子进程中调用，内存峰值只包含该测试项）
+
+    返回 {'seconds', 'files', 'megapixels', 'trials', 'peak_rss_mb'}，seconds 为多次运行的中位数
+    """
+    from png_to_webp import convert_png_to_webp, convert_single_file, save_optimized_webp, save_variant
+    from merge_images import merge_images
+    from variants import Variant
+    from webp_encoder import search_quality
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files = [Path(path) for path in files]
+    sizes = {path: Image.open(path).size for path in files}
+    pairs = [(left, right) for left, right in zip(files[0::2], files[1::2]) if sizes[left] == sizes[right]]
+    if case == 'merge':
+        work_items = len(pairs)
+        pixels = sum(w * h * 2 for w, h in (sizes[left] for left, _ in pairs))
+    else:
+        work_items = len(files)
+        pixels = sum(w * h for w, h in sizes.values())
+
+    if case == 'batch':
+        # 只转换本次的图片（--corpus-dir 中可能还有其他尺寸的图片）
+        batch_dir = output_dir / 'input'
+        batch_dir.mkdir(exist_ok=True)
+        for path in files:
+            shutil.copyfile(path, batch_dir / path.name)
+
+    def run_once():
+        trials = 0
+        if case == 'convert':
+            for path in files:
+                trials += convert_single_file(path, output_dir / f"{path.stem}.webp", 80).trials
+        elif case == 'cropped':
+            for path in files:
+                with Image.open(path) as img:
+                    img.load()
+                    trials += save_variant(img, Variant('cropped', crop_ratio=4), output_dir / f"{path.stem}.webp",
+                                           80, os.path.getsize(path)).trials
+        elif case == 'search':
+            for path in files:
+                with Image.open(path) as img:
+                    img.load()
+                    target = os.path.getsize(path) * 0.5
+                    trials += len(search_quality(img, 80, 100, lambda size: size <= target)[2])
+        elif case == 'perceptual':
+            # 与 convert 比较即为感知质量评分（每次试编码解码一次）的额外耗时
+            for path in files:
+                with Image.open(path) as img:
+                    img.load()
+                    trials += save_optimized_webp(img, output_dir / f"{path.stem}.webp", 80, os.path.getsize(path),
+                                                  target_score=PERCEPTUAL_TARGET).trials
+        elif case == 'auto':
+            # 与 convert 比较即为内容分类和无损候选编码的额外耗时（或省去的有损查找）
+            for path in files:
+                trials += convert_single_file(path, output_dir / f"{path.stem}.webp", 80, encoding='auto').trials
+        elif case == 'batch':
+            records = convert_png_to_webp(str(batch_dir), str(output_dir / 'webp'), workers=workers, quiet=True)
+            trials += sum(record.trials for record in records)
+        elif case == 'merge':
+            for left, right in pairs:
+                trials += len(merge_images(left, right, output_dir / f"{left.stem}_{right.stem}.webp").trials)
+        return trials
+
+    timings = []
+    trials = 0
+    # 测试项内部的控制台输出不影响结果
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            trials = run_once()
+            timings.append(time.perf_counter() - started)
+
+    return {
+        'seconds': round(statistics.median(timings), 4),
+        'files': work_items,
+        'megapixels': round(pixels / 1e6, 3),
+        'trials': trials,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def run_benchmark(sizes=DEFAULT_SIZES, cases=CASES, repeat=3, workers=None, corpus_dir=None, count=1):
+    """
+    生成合成图片并依次运行各测试项，返回结果字典（可保存为基准JSON）
+
+    每个测试项在新的子进程中运行，避免前一项的内存占用和缓存影响后一项。
+    """
+    sizes = [parse_size(size) if isinstance(size, str) else tuple(size) for size in sizes]
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory(prefix='webp_bench_') as temp_dir:
+        corpus = generate_corpus(corpus_dir or Path(temp_dir) / 'corpus', sizes, count)
+        results = {}
+        for case in cases:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_case, case, [str(path) for path in corpus],
+                                         str(Path(temp_dir) / 'output' / case), repeat, workers).result()
+            result['mp_per_s'] = round(result['megapixels'] / max(result['seconds'], 1e-9), 3)
+            result['files_per_s'] = round(result['files'] / max(result['seconds'], 1e-9), 3)
+            results[case] = result
+            print(format_result(case, result))
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': {
+            'sizes': [f"{width}x{height}" for width, height in sizes],
+            'count': count,
+            'repeat': repeat,
+            'workers': workers,
+        },
+        'cases': results,
+    }
+
+def compare_to_baseline(results, baseline, tolerance=0.1):
+    """
+    与基准结果比较，返回回归列表 [(测试项, 说明), ...]
+
+    耗时超过基准的 (1 + tolerance) 倍，或试编码次数多于基准时视为回归。
+    """
+    if results['settings'] != baseline.get('settings'):
+        print(f"警告: 测试设置与基准不同（当前 {results['settings']}，基准 {baseline.get('settings')}）")
+
+    regressions = []
+    for case, result in results['cases'].items():
+        reference = baseline.get('cases', {}).get(case)
+        if reference is None:
+            continue
+        ratio = result['seconds'] / max(reference['seconds'], 1e-9)
+        print(f"{case}: 耗时 {reference['seconds']:.3f}秒 -> {result['seconds']:.3f}秒 ({(ratio - 1) * 100:+.1f}%)，"
+              f"试编码 {reference['trials']} -> {result['trials']}")
+        if ratio > 1 + tolerance:
+            regressions.append((case, f"耗时增加 {(ratio - 1) * 100:.1f}%"))
+        if result['trials'] > reference['trials']:
+            regressions.append((case, f"试编码次数增加 {reference['trials']} -> {result['trials']}"))
+    return regressions
+
+def format_result(case, result):
+    peak = f"{result['peak_rss_mb']:.1f}MB" if result['peak_rss_mb'] is not None else "未知"
+    return (f"{case}: {result['seconds']:.3f}秒, {result['mp_per_s']:.2f} MP/s, {result['files_per_s']:.2f}个/秒, "
+            f"试编码 {result['trials']} 次, 内存峰值 {peak}")
+
+if __name__ == "__main__":
+    # 命令行参数统一在 webp_cli 中定义，python benchmark.py ... 等同于 python webp_cli.py bench ...
+    from webp_cli import main
+    sys.exit(main(['bench'] + sys.argv[1:]))
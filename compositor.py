@@ -0,0 +1,135 @@
+from PIL import Image, ImageDraw
+
+try:
+    import numpy as np
+except ImportError:  # 没有NumPy时退回Pillow实现
+    np = None
+
+# 合成图片的宽高比
+ASPECT_RATIO = 16/9
+
+def compose_comparison(img1, img2, final_width=960, prescale=False):
+    """
+    把两张图片合成为中间用斜线分割的对比图
+
+    左半部分为 img1（向左偏移25%），右半部分为 img2（向右偏移25%），中间画白色分割线，
+    最后缩放到 final_width 宽（16:9）。
+
+    参数:
+        img1: 左侧图片
+        img2: 右侧图片
+        final_width: 输出宽度（默认960）
+        prescale: 是否先把输入缩放到输出尺寸再合成。输入远大于输出时省去全分辨率的中间图片，
+                  缩放时先按整数倍快速缩小（reducing_gap=2）再用LANCZOS。
+                  误差范围：斜边和分割线在输出分辨率上绘制，两侧几个像素内可能有较大差异；
+                  其他像素的差异只来自缩放算法，自然图片的平均绝对误差小于1（每通道0-255）
+
+    合成时不创建整幅的临时画布和多边形遮罩，只在斜边所在的窄条上使用遮罩
+    （安装了NumPy时用向量化方式生成）；不使用 prescale 时结果与原先先贴到两张临时画布、
+    再用整幅多边形遮罩合成的结果逐像素一致。
+    """
+    final_height = int(final_width / ASPECT_RATIO)
+
+    (process_width, process_height), resample = processing_size(img1.width, final_width, prescale)
+    img1 = prepare_source(img1, (process_width, process_height), resample)
+    img2 = prepare_source(img2, (process_width, process_height), resample)
+
+    # 定义斜线位置
+    split_x = process_width // 2  # 中心点
+    split_offset = int(process_width * 50/960)  # 按比例计算偏移
+    # 计算偏移量（25%）
+    offset = int(process_width * 0.25)
+
+    result = _composite(img1, img2, split_x, split_offset, offset)
+
+    # 添加白色分割线（增加线宽以适应高分辨率）
+    draw = ImageDraw.Draw(result)
+    line_width = max(3, int(process_width * 3/960))  # 根据分辨率调整线宽
+    draw.line(
+        [(split_x, 0), (split_x + split_offset, process_height)],
+        fill='white',
+        width=line_width
+    )
+
+    # 最后才调整到目标尺寸
+    if process_width != final_width:
+        result = result.resize((final_width, final_height), Image.Resampling.LANCZOS)
+    return result
+
+def processing_size(source_width, final_width=960, prescale=False):
+    """
+    合成时的处理尺寸和缩放算法，返回 ((宽, 高), resample)，resample 为None表示默认算法
+
+    prescale 且左图宽于输出时直接在输出尺寸上合成，否则保持左图宽度、高度适应16:9。
+    """
+    if prescale and source_width > final_width:
+        return (final_width, int(final_width / ASPECT_RATIO)), Image.Resampling.LANCZOS
+    return (source_width, int(source_width / ASPECT_RATIO)), None
+
+def prepare_source(img, size, resample):
+    """
+    把一张输入图片缩放到处理尺寸（已是该尺寸时原样返回）
+
+    预先处理过的图片再传给 compose_comparison 时不会重复缩放，结果相同。
+    """
+    if resample is not None and img.mode not in ('RGB', 'RGBA'):
+        # 调色板等模式先转换，避免按最近邻缩放
+        img = img.convert('RGBA')
+    return _resize(img, size, resample)
+
+def _resize(img, size, resample):
+    if img.size == size:
+        return img
+    if resample is None:
+        return img.resize(size)
+    return img.resize(size, resample, reducing_gap=2.0)
+
+def split_boundary(width, height, split_x, split_offset, row):
+    """
+    第 row 行中右侧图片开始的列（row 可以是NumPy数组）
+
+    与 ImageDraw.polygon 填充 (split_x, 0) - (width, 0) - (width, height) - (split_x + split_offset, height)
+    的结果一致：边界为 floor(split_x + split_offset * row / height + 0.5)。
+    """
+    return (2 * split_x * height + 2 * split_offset * row + height) // (2 * height)
+
+def _composite(img1, img2, split_x, split_offset, offset):
+    """
+    把两张偏移后的图片直接贴到结果图片上，不创建整幅的临时画布和遮罩
+
+    斜边只出现在 [band_start, band_end) 这一窄条列中：左边的列整列来自左图，
+    右边的列整列来自右图，都直接贴图；只有这一窄条需要遮罩。
+    """
+    width, height = img1.size
+    band_start = split_boundary(width, height, split_x, split_offset, 0)
+    band_end = split_boundary(width, height, split_x, split_offset, height - 1) + 1
+
+    # 超出图片范围的部分保持透明
+    result = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    # 左图向左偏移（贴图时自动裁掉超出的部分），斜边右侧随后被右图覆盖
+    result.paste(img1, (-offset, 0))
+    # 右图向右偏移，只贴斜边右侧的整列
+    if band_end < width:
+        result.paste(img2.crop((band_end - offset, 0, width - offset, height)), (band_end, 0))
+    # 斜边所在的窄条按遮罩贴右图
+    band = img2.crop((band_start - offset, 0, band_end - offset, height))
+    result.paste(band, (band_start, 0), _band_mask(width, height, split_x, split_offset, band_start, band_end))
+    return result
+
+def _band_mask(width, height, split_x, split_offset, band_start, band_end):
+    """斜边窄条的遮罩，右侧图片的像素为255"""
+    if np is not None:
+        rows = np.arange(height, dtype=np.int64)[:, None]
+        columns = np.arange(band_start, band_end, dtype=np.int64)
+        right = columns >= split_boundary(width, height, split_x, split_offset, rows)
+        return Image.fromarray(right.astype(np.uint8) * 255, 'L')
+
+    # 没有NumPy时在窄条上绘制平移后的多边形
+    mask = Image.new('L', (band_end - band_start, height), 0)
+    ImageDraw.Draw(mask).polygon([
+        (split_x - band_start, 0),
+        (width - band_start, 0),
+        (width - band_start, height),
+        (split_x + split_offset - band_start, height)
+    ], fill=255)
+    return mask
@@ -0,0 +1,163 @@
+from dataclasses import dataclass, replace
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops
+
+from rate_control import RateResult
+from webp_encoder import encode_webp
+
+# 分类时抽样的像素数（约16个 64x64 方块，大图也只需几毫秒）
+SAMPLE_PIXELS = 256 * 256
+# 相邻像素亮度差不小于此值时算作锐利边缘
+EDGE_THRESHOLD = 48
+# 相邻像素完全相同的比例低于此值时按照片处理（照片几乎没有完全相同的相邻像素）
+FLAT_MIN = 0.2
+# 变化的相邻像素中锐利边缘的比例（文字、线条、界面元素的边缘）
+SHARP_MIN = 0.5
+# 出现最多的256种颜色覆盖抽样像素的比例：达到前者时无损编码，达到后者时近无损编码
+LOSSLESS_COVERAGE = 0.99
+NEAR_LOSSLESS_COVERAGE = 0.95
+# 近无损编码允许的误差：99.9%的像素的亮度误差不超过 NEAR_LOSSLESS_TOLERANCE
+NEAR_LOSSLESS_TOLERANCE = 12
+NEAR_LOSSLESS_PERCENTILE = 0.999
+# 近无损编码时统计颜色数的上限，颜色更多的图片不使用近无损
+NEAR_LOSSLESS_MAX_COLORS = 1 << 18
+# 无损编码的压缩等级和方法：method=6、quality=100 慢十倍以上，文件只小几个百分点
+LOSSLESS_EFFORT = 75
+LOSSLESS_METHOD = 4
+
+@dataclass
+class ContentClass:
+    """
+    图片内容的分类结果（由抽样像素统计）
+
+    属性:
+        decision: 'lossless'（界面截图、示意图等颜色少且边缘锐利的图片）、'near_lossless'（颜色集中，
+                  有抗锯齿或柔和细节）、'lossy'（照片等）或 'unsure'（无法判断，同时尝试无损和有损编码）
+        colors: 抽样像素中的颜色数（按照片处理时不统计，为None）
+        coverage: 出现最多的256种颜色覆盖的像素比例（按照片处理时为None）
+        flat: 水平相邻像素完全相同的比例
+        sharp: 不同的相邻像素中锐利边缘（亮度差不小于 EDGE_THRESHOLD）的比例
+    """
+    decision: str
+    colors: int
+    coverage: float
+    flat: float
+    sharp: float
+
+def classify_content(img):
+    """按抽样像素的颜色数、256色覆盖率、平坦区域和边缘比例判断适合的编码方式，返回 ContentClass"""
+    # perceptual 会导入NumPy，只在分类时导入，不影响其他转换的启动时间
+    from perceptual import tile_boxes
+
+    boxes = tile_boxes(img.size, SAMPLE_PIXELS)
+    # 先裁剪再转换，只处理抽样的像素；多个方块拼成一行
+    sample_mode = img.mode if img.mode in ('RGB', 'RGBA', 'L') else 'RGBA' if _has_alpha(img) else 'RGB'
+    tiles = [img.crop(box).convert(sample_mode) for box in boxes]
+    sample = Image.new(sample_mode, (sum(tile.width for tile in tiles), max(tile.height for tile in tiles)))
+    left = 0
+    for tile in tiles:
+        sample.paste(tile, (left, 0))
+        left += tile.width
+
+    if sample.width > 1:
+        differences = ImageChops.difference(sample.crop((1, 0, sample.width, sample.height)),
+                                            sample.crop((0, 0, sample.width - 1, sample.height)))
+        histogram = differences.convert('L').histogram()
+        pairs = sum(histogram)
+        flat = histogram[0] / pairs
+        changed = pairs - histogram[0]
+        sharp = sum(histogram[EDGE_THRESHOLD:]) / changed if changed else 1.0
+    else:
+        flat, sharp = 1.0, 1.0
+
+    if flat < FLAT_MIN:
+        # 照片的颜色很多，统计颜色比其他所有步骤都慢，不再统计
+        return ContentClass('lossy', None, None, flat, sharp)
+
+    pixels = sample.width * sample.height
+    counts = sorted((count for count, _ in sample.getcolors(pixels)), reverse=True)
+    coverage = sum(counts[:256]) / pixels
+    if sharp >= SHARP_MIN and coverage >= LOSSLESS_COVERAGE:
+        decision = 'lossless'
+    elif coverage >= NEAR_LOSSLESS_COVERAGE:
+        decision = 'near_lossless'
+    else:
+        decision = 'unsure'
+    return ContentClass(decision, len(counts), coverage, flat, sharp)
+
+def _has_alpha(img):
+    return 'A' in img.getbands() or 'transparency' in img.info
+
+def near_lossless_image(img, tolerance=NEAR_LOSSLESS_TOLERANCE):
+    """
+    近无损版本：把每个像素换成出现最多的256种颜色中最接近的一种（调色板图片，无损编码时很小）
+
+    只支持RGB图片（包括全不透明的RGBA图片）；颜色过多或误差超出 tolerance（见 NEAR_LOSSLESS_PERCENTILE）时返回None。
+    """
+    if img.mode == 'RGBA' and img.getchannel('A').getextrema() == (255, 255):
+        img = img.convert('RGB')
+    if img.mode != 'RGB':
+        return None
+    colors = img.getcolors(NEAR_LOSSLESS_MAX_COLORS)
+    if colors is None:
+        return None
+    palette = [value for _, color in sorted(colors, reverse=True)[:256] for value in color]
+    palette_img = Image.new('P', (1, 1))
+    palette_img.putpalette(palette + palette[:3] * (256 - len(palette) // 3))
+    quantized = img.quantize(palette=palette_img, dither=Image.Dither.NONE)
+
+    histogram = ImageChops.difference(img, quantized.convert('RGB')).convert('L').histogram()
+    allowed = (1 - NEAR_LOSSLESS_PERCENTILE) * img.width * img.height
+    if sum(histogram[tolerance + 1:]) > allowed:
+        return None
+    return quantized
+
+def encode_auto(img, lossy, fits, content=None):
+    """
+    按图片内容选择无损、近无损或有损编码，返回 RateResult（encoding 为实际使用的编码方式）
+
+    参数:
+        img: 要编码的图片
+        lossy: 执行有损质量查找的函数（无参数，返回 RateResult）
+        fits: 判断编码结果（字节）是否满足要求的函数，例如不超过目标大小
+        content: classify_content 的结果（可选，默认现场分类）
+
+    分类为 lossless/near_lossless 时先编码该候选，满足 fits 时直接使用，不再进行有损查找；
+    分类为 unsure（或近无损误差过大）时，无损编码在另一个线程中与有损查找同时进行。
+    候选与有损结果都有时，优先满足 fits 的一个，都满足或都不满足时取较小的一个。
+    无损候选的试编码记为一次试编码，质量参数记为None。
+    """
+    content = content or classify_content(img)
+    if content.decision == 'lossy':
+        return lossy()
+
+    candidate = None
+    if content.decision == 'near_lossless':
+        quantized = near_lossless_image(img)
+        if quantized is not None:
+            candidate = _lossless_result(quantized, img.size, 'near_lossless')
+    elif content.decision == 'lossless':
+        candidate = _lossless_result(img, img.size, 'lossless')
+
+    if candidate is not None:
+        if fits(candidate.data):
+            return candidate
+        result = lossy()
+    else:
+        # 无法判断时同时进行：编码期间会释放GIL，两者的耗时重叠。
+        # save() 会在图片对象上写入 encoderinfo，无损编码使用共享像素数据的独立包装对象
+        img.load()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            lossless = executor.submit(_lossless_result, img._new(img.im), img.size, 'lossless')
+            result = lossy()
+            candidate = lossless.result()
+
+    trials = candidate.trials + result.trials
+    if (fits(candidate.data), -candidate.bytes_out) >= (fits(result.data), -result.bytes_out):
+        return replace(candidate, trials=trials, target_size=result.target_size)
+    return replace(result, trials=trials)
+
+def _lossless_result(img, size, encoding):
+    data = encode_webp(img, LOSSLESS_EFFORT, LOSSLESS_METHOD, lossless=True)
+    return RateResult(None, data, [(None, len(data))], size, 1.0, None, encoding)
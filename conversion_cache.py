@@ -0,0 +1,160 @@
+import PIL
+from PIL import features
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from webp_encoder import WEBP_METHOD, write_atomic
+
+# 缓存格式版本，条目结构变化时递增以使旧缓存失效
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = Path.home() / '.webp_tools_cache'
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+# 上次淘汰后新加入的输出超过容量的这个比例时再淘汰一次
+PRUNE_FRACTION = 0.1
+
+class ConversionCache:
+    """
+    按内容寻址的转换缓存
+
+    键为源文件内容的哈希加上所有影响输出的参数（含编码方法和Pillow/libwebp版本），
+    每个条目是一个目录，保存所选质量、输出哈希以及输出文件本身。
+    命中时若目标文件已是相同内容则直接跳过，否则复制缓存中的输出。
+    按最近使用时间（LRU）淘汰，总大小不超过 max_bytes；批量转换中由 added 定期淘汰，
+    长时间运行时缓存最多超出容量的 PRUNE_FRACTION。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.added_bytes = 0
+
+    def make_key(self, source_data, params):
+        """根据源文件内容和转换参数计算缓存键"""
+        key_params = dict(params)
+        key_params.update({
+            'cache_version': CACHE_VERSION,
+            'method': WEBP_METHOD,
+            'pillow': PIL.__version__,
+            'libwebp': features.version('webp'),
+        })
+        digest = hashlib.sha256(source_data)
+        digest.update(json.dumps(key_params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def restore(self, key, outputs):
+        """
+        尝试从缓存恢复输出文件
+
+        参数:
+            key: 缓存键
+            outputs: {输出名称: 输出路径}
+
+        返回:
+            命中时返回 {输出名称: (质量参数, 编码方式)}，未命中返回None
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(entry_dir / 'entry.json', 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if set(entry['outputs']) != set(outputs):
+            return None
+
+        try:
+            for name, output_file in outputs.items():
+                output = entry['outputs'][name]
+                # 目标文件已是相同内容时直接跳过
+                if _file_matches(output_file, output['size'], output['sha256']):
+                    continue
+                write_atomic(output_file, (entry_dir / f"{name}.webp").read_bytes())
+            # 更新访问时间用于LRU淘汰（条目可能刚被其他进程淘汰，按未命中处理）
+            os.utime(entry_dir / 'entry.json')
+        except OSError:
+            return None
+
+        return {name: (output['quality'], output.get('encoding', 'lossy')) for name, output in entry['outputs'].items()}
+
+    def store(self, key, outputs):
+        """
+        保存转换结果
+
+        参数:
+            key: 缓存键
+            outputs: {输出名称: (输出路径, 质量参数, 编码方式)}
+        """
+        entry_dir = self._entry_dir(key)
+        if entry_dir.exists():
+            return
+
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = Path(tempfile.mkdtemp(dir=entry_dir.parent, prefix=key + '.', suffix='.temp'))
+        try:
+            entry = {'created': time.time(), 'outputs': {}}
+            for name, (output_file, quality, encoding) in outputs.items():
+                data = Path(output_file).read_bytes()
+                (temp_dir / f"{name}.webp").write_bytes(data)
+                entry['outputs'][name] = {
+                    'quality': quality,
+                    'encoding': encoding,
+                    'size': len(data),
+                    'sha256': hashlib.sha256(data).hexdigest(),
+                }
+            with open(temp_dir / 'entry.json', 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            # 多个进程同时写入同一条目时，只保留先完成的那个
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def added(self, size):
+        """记录新加入缓存的输出大小（字节），上次淘汰后累计超过 max_bytes 的 PRUNE_FRACTION 时淘汰一次"""
+        self.added_bytes += size
+        if self.added_bytes > self.max_bytes * PRUNE_FRACTION:
+            self.prune()
+
+    def prune(self):
+        """按LRU淘汰条目，使缓存总大小不超过 max_bytes"""
+        self.added_bytes = 0
+        entries = []
+        total_size = 0
+        if not self.cache_dir.exists():
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.temp') or not entry.is_dir():
+                    continue
+                try:
+                    last_used = os.stat(os.path.join(entry.path, 'entry.json')).st_mtime
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                except OSError:
+                    continue
+                entries.append((last_used, size, entry.path))
+                total_size += size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+    def _entry_dir(self, key):
+        return self.cache_dir / key[:2] / key
+
+def _file_matches(path, size, sha256):
+    """检查已有文件是否与缓存内容一致"""
+    try:
+        if os.path.getsize(path) != size:
+            return False
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest() == sha256
+    except OSError:
+        return False
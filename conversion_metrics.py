@@ -0,0 +1,241 @@
+import json
+import math
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+
+# 控制台输出中编码方式的名称
+ENCODING_NAMES = {'lossy': "有损", 'lossless': "无损", 'near_lossless': "近无损（256色）"}
+
+@contextmanager
+def timed(timings, stage):
+    """把代码块的耗时（秒）累加到 timings[stage]"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+@dataclass
+class OutputRecord:
+    """
+    一个输出版本的结果
+
+    属性:
+        variant: 版本名称
+        path: 输出文件路径
+        width, height: 输出尺寸
+        source_width, source_height: 源图片尺寸
+        crop_ratio: 中心裁剪比率
+        scaled: 裁剪后是否缩放到指定宽度
+        quality: 使用的质量参数
+        reference_size: 压缩目标的参考大小（字节）
+        target_size: 目标大小（字节）
+        bytes_out: 输出文件大小（字节）
+        scale: 为满足目标大小缩小的比例（未缩小时为1）
+        trials: 质量查找中的试编码次数（缓存命中时为0）
+        target_score: 感知质量查找的目标评分（SSIM，未使用时为None）
+        score: 输出与源图片的评分（感知质量查找时记录）
+        encoding: 编码方式，'lossy'、'lossless' 或 'near_lossless'（无损和近无损时 quality 为None）
+        prediction_checks: 质量预测校验（QualityPredictor 的 verify）的次数
+        prediction_mismatches: 其中预测查找与完整二分选中的质量不一致的次数
+        timings: 各阶段耗时（秒），例如 render、encode、score、write（encode 不包含 score）
+    """
+    variant: str
+    path: str
+    width: int = 0
+    height: int = 0
+    source_width: int = 0
+    source_height: int = 0
+    crop_ratio: int = 1
+    scaled: bool = False
+    quality: int = None
+    reference_size: int = 0
+    target_size: int = 0
+    bytes_out: int = 0
+    scale: float = 1.0
+    trials: int = 0
+    target_score: float = None
+    score: float = None
+    encoding: str = 'lossy'
+    prediction_checks: int = 0
+    prediction_mismatches: int = 0
+    timings: dict = field(default_factory=dict)
+
+@dataclass
+class ConversionRecord:
+    """
+    一个源文件的转换结果
+
+    属性:
+        source: 源文件路径
+        bytes_in: 源文件大小（字节）
+        decodes: 源图片解码次数（缓存命中时为0）
+        cache_hit: 是否由转换缓存恢复
+        resumed: 是否在之前的运行中已完成（由批量转换日志恢复，未重新转换）
+        outputs: 各输出版本的 OutputRecord
+        timings: 各阶段耗时（秒）: read、decode、analyze 以及各版本的 render、encode、write 之和，total 为总耗时
+        error: 失败时的错误信息
+    """
+    source: str
+    bytes_in: int = 0
+    decodes: int = 0
+    cache_hit: bool = False
+    resumed: bool = False
+    outputs: list = field(default_factory=list)
+    timings: dict = field(default_factory=dict)
+    error: str = None
+
+    @property
+    def bytes_out(self):
+        return sum(output.bytes_out for output in self.outputs)
+
+    @property
+    def trials(self):
+        return sum(output.trials for output in self.outputs)
+
+    def add_output(self, output):
+        self.outputs.append(output)
+        for stage, seconds in output.timings.items():
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def to_dict(self):
+        record = asdict(self)
+        record['bytes_out'] = self.bytes_out
+        record['trials'] = self.trials
+        return record
+
+class MetricsLog:
+    """把转换记录逐行追加到JSONL文件（每条记录写入后立即刷新，中途停止也不丢失）"""
+
+    def __init__(self, path):
+        try:
+            self.file = open(path, 'a', encoding='utf-8')
+        except OSError as e:
+            raise Exception(f"无法打开指标文件 {path}: {str(e)}")
+
+    def write(self, record):
+        self.file.write(json.dumps(record.to_dict(), ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def percentile(values, p):
+    """最近秩法百分位数，values 为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def summarize(records, elapsed=None):
+    """
+    汇总一批转换记录
+
+    返回字典: 文件数、成功/失败/缓存命中/之前已完成的文件数、输入输出字节数、试编码次数、质量预测的校验和不一致次数，
+    以及每个文件的总耗时、编码耗时、试编码次数和各版本与目标大小的偏差的 p50/p90/p99/最大值
+    （之前已完成的文件不计入这些统计）
+    """
+    succeeded = [record for record in records if record.error is None]
+    converted = [record for record in succeeded if not record.resumed]
+    summary = {
+        'files': len(records),
+        'succeeded': len(succeeded),
+        'failed': len(records) - len(succeeded),
+        'cache_hits': sum(record.cache_hit for record in succeeded),
+        'resumed': len(succeeded) - len(converted),
+        'bytes_in': sum(record.bytes_in for record in succeeded),
+        'bytes_out': sum(record.bytes_out for record in succeeded),
+        'trials': sum(record.trials for record in succeeded),
+        'prediction_checks': sum(output.prediction_checks for record in succeeded for output in record.outputs),
+        'prediction_mismatches': sum(output.prediction_mismatches
+                                     for record in succeeded for output in record.outputs),
+        'over_target': sum(output.bytes_out > output.target_size
+                           for record in converted for output in record.outputs if output.target_size),
+        'elapsed': elapsed,
+    }
+    series = {
+        'total_seconds': [record.timings.get('total', 0.0) for record in converted],
+        'encode_seconds': [record.timings.get('encode', 0.0) for record in converted],
+        'trials_per_file': [record.trials for record in converted],
+        'target_deviation': [output.bytes_out / output.target_size - 1
+                             for record in converted for output in record.outputs if output.target_size],
+    }
+    for name, values in series.items():
+        summary[name] = {f"p{p}": percentile(values, p) for p in (50, 90, 99)}
+        summary[name]['max'] = max(values, default=None)
+    return summary
+
+def format_record(record):
+    """转换记录的控制台输出"""
+    if record.error:
+        return f"转换失败 {record.source}: {record.error}"
+    if record.cache_hit:
+        return f"缓存命中，跳过转换: {record.source}\n" + "-" * 50
+    if record.resumed:
+        return f"之前的运行中已完成，跳过转换: {record.source}\n" + "-" * 50
+
+    lines = []
+    for output in record.outputs:
+        lines.append(f"转换完成: {output.path}")
+        lines.append(f"原始大小: {output.reference_size/1024:.1f}KB")
+        lines.append(f"转换后大小: {output.bytes_out/1024:.1f}KB")
+        lines.append(f"压缩率: {output.bytes_out / max(output.reference_size, 1) * 100:.1f}%")
+        if output.encoding == 'lossy':
+            lines.append(f"使用的质量参数: {output.quality}")
+        else:
+            lines.append(f"编码方式: {ENCODING_NAMES.get(output.encoding, output.encoding)}")
+        if output.target_size:
+            deviation = (output.bytes_out / output.target_size - 1) * 100
+            lines.append(f"目标大小: {output.target_size/1024:.1f}KB (偏差 {deviation:+.1f}%"
+                         + ("，未达到目标)" if deviation > 0 else ")"))
+        if output.target_score is not None:
+            lines.append(f"感知质量(SSIM): {output.score:.4f} (目标 {output.target_score}"
+                         + ("，未达到目标)" if output.score < output.target_score else ")"))
+        if output.prediction_mismatches:
+            lines.append(f"质量预测校验: 预测查找与完整二分选中的质量不一致（{output.prediction_mismatches}次）")
+        if output.scale != 1:
+            lines.append(f"为满足目标大小缩小到 {output.width}x{output.height} ({output.scale:.0%})")
+        lines.append("-" * 50)
+        if output.variant != 'full':
+            lines.append(f"创建{output.variant}版本: {output.path}")
+            if output.scaled:
+                lines.append(f"尺寸: {output.width}x{output.height} (原图 {output.source_width}x{output.source_height})")
+            else:
+                lines.append(f"裁剪尺寸: {output.width}x{output.height} (原图的 1/{output.crop_ratio})")
+            lines.append("-" * 50)
+    return '\n'.join(lines)
+
+def format_summary(summary):
+    """批量转换汇总的控制台输出"""
+    lines = [f"转换完成: {summary['succeeded']}个成功, {summary['failed']}个失败"
+             + (f", {summary['cache_hits']}个缓存命中" if summary['cache_hits'] else "")
+             + (f", {summary['resumed']}个在之前的运行中已完成" if summary['resumed'] else "")]
+    if summary['elapsed']:
+        lines[0] += f", 耗时 {summary['elapsed']:.1f}秒 ({summary['files'] / summary['elapsed']:.2f}个/秒)"
+    if summary['succeeded']:
+        ratio = summary['bytes_out'] / max(summary['bytes_in'], 1) * 100
+        lines.append(f"总大小: {summary['bytes_in']/1024:.1f}KB -> {summary['bytes_out']/1024:.1f}KB ({ratio:.1f}%)，"
+                     f"试编码 {summary['trials']} 次")
+        for name, label, unit in (('total_seconds', "每个文件耗时", "秒"), ('encode_seconds', "编码耗时", "秒"),
+                                  ('trials_per_file', "试编码次数", "")):
+            stats = summary[name]
+            if stats['max'] is None:
+                continue
+            lines.append(f"{label}: " + ", ".join(
+                f"{key} {value:.2f}{unit}" if unit else f"{key} {value}" for key, value in stats.items()))
+        stats = summary['target_deviation']
+        if stats['max'] is not None:
+            lines.append("与目标大小的偏差: " + ", ".join(f"{key} {value * 100:+.1f}%" for key, value in stats.items())
+                         + (f"，{summary['over_target']}个版本未达到目标" if summary['over_target'] else ""))
+        if summary['prediction_checks']:
+            lines.append(f"质量预测校验: {summary['prediction_checks']}次，"
+                         f"{summary['prediction_mismatches']}次与完整二分不一致")
+    return '\n'.join(lines)
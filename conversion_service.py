@@ -0,0 +1,401 @@
+import contextlib
+import io
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from conversion_metrics import percentile
+
+# 各类作业的必填参数和可选参数（与 convert_png_to_webp、merge_images 的参数名相同）
+JOB_PARAMETERS = {
+    'convert': (('input_path',),
+                ('output_path', 'min_quality', 'create_cropped', 'crop_ratio', 'recursive', 'cropped_target_kb',
+                 'variants', 'target_ratio', 'max_trials', 'min_scale', 'target_score', 'encoding')),
+    'merge': (('image1_path', 'image2_path', 'output_path'),
+              ('final_width', 'target_size_kb', 'prescale', 'max_trials', 'min_scale', 'low_memory')),
+}
+# 作业ID只允许这些字符，最长128个
+JOB_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,128}')
+# 请求体大小上限（字节）
+MAX_BODY_BYTES = 1024 * 1024
+# ?wait= 的最长等待秒数
+MAX_WAIT_SECONDS = 300
+# 统计耗时百分位数时保留的最近作业数
+LATENCY_WINDOW = 1000
+
+class ServiceBusy(Exception):
+    """队列已满或服务正在关闭，客户端应稍后重试"""
+
+class JobConflict(Exception):
+    """同一个作业ID已用于参数不同的作业"""
+
+def _warm_up():
+    # 工作进程不继承服务的信号处理：Ctrl+C 只停止服务进程（由它关闭进程池），SIGTERM 直接结束工作进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # 工作进程启动时预先导入，请求到来时不再承担导入Pillow和编码模块的开销
+    import merge_images  # noqa: F401
+    import png_to_webp  # noqa: F401
+    from PIL import Image
+    Image.init()
+
+def _ping():
+    return os.getpid()
+
+def run_job(kind, params):
+    """在工作进程中执行一个作业，返回可序列化为JSON的结果（作业内的控制台输出被丢弃）"""
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if kind == 'convert':
+            from png_to_webp import convert_png_to_webp
+            from variants import parse_variant
+            params = dict(params)
+            if params.get('variants'):
+                params['variants'] = [parse_variant(spec) for spec in params['variants']]
+            # 作业之间已经在进程池中并行，单个作业内不再创建进程
+            records = convert_png_to_webp(workers=1, quiet=True, **params)
+            result = {'records': [record.to_dict() for record in records],
+                      'failed': sum(1 for record in records if record.error)}
+        else:
+            from merge_images import merge_images
+            rate = merge_images(**params)
+            result = {'quality': rate.quality, 'bytes': rate.bytes_out, 'deviation': rate.deviation,
+                      'trials': len(rate.trials), 'scale': rate.scale}
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def validate_params(kind, params):
+    """检查作业参数，返回只包含已知参数的字典，参数有误时抛出 ValueError"""
+    if kind not in JOB_PARAMETERS:
+        raise ValueError(f"未知的作业类型: {kind}")
+    if not isinstance(params, dict):
+        raise ValueError("请求体应为JSON对象")
+    required, optional = JOB_PARAMETERS[kind]
+    missing = [name for name in required if params.get(name) in (None, '')]
+    if missing:
+        raise ValueError(f"缺少参数: {', '.join(missing)}")
+    unknown = [name for name in params if name not in required + optional]
+    if unknown:
+        raise ValueError(f"未知的参数: {', '.join(unknown)}（可用: {', '.join(required + optional)}）")
+    if params.get('variants'):
+        from variants import parse_variant
+        if not isinstance(params['variants'], list) or not all(isinstance(spec, str) for spec in params['variants']):
+            raise ValueError("variants 应为版本描述字符串的列表，例如 [\"full\", \"cropped:crop=4\"]")
+        for spec in params['variants']:
+            parse_variant(spec)
+    return {name: params[name] for name in required + optional if params.get(name) is not None}
+
+class ServiceJob:
+    """
+    服务中的一个作业，status 为 queued、running、done 或 failed
+
+    running 表示作业已交给进程池（进程池会预先取走一个排队的作业，因此可能比工作进程数多一个）。
+    """
+
+    def __init__(self, job_id, kind, params):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self.result = None
+        self.error = None
+
+    @property
+    def status(self):
+        if self.finished is not None:
+            return 'failed' if self.error else 'done'
+        if self.future is not None and self.future.running():
+            return 'running'
+        return 'queued'
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'params': self.params,
+            'created': self.created,
+            'finished': self.finished,
+            'result': self.result,
+            'error': self.error,
+        }
+
+class ConversionService:
+    """
+    常驻的转换服务：作业在预热过的进程池中执行
+
+    进程池在创建服务时启动，每个工作进程预先导入Pillow和编码模块，之后一直保留。
+    同时接受的作业（排队和执行中）最多为 workers + queue_size 个，超出时 submit 抛出 ServiceBusy（背压）。
+    客户端可以指定作业ID：同一个ID重复提交同样的参数时返回已有作业，不会重复执行；参数不同时抛出 JobConflict。
+    已结束的作业保留最近的 max_finished 个供查询。
+    """
+
+    def __init__(self, workers=None, queue_size=64, max_finished=1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers + queue_size
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.active = 0
+        self.counters = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.run_seconds = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+        self.closed = False
+        self.condition = threading.Condition()
+        self._pool_lock = threading.Lock()
+        self._executor = self._start_pool()
+
+    def _start_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+        # 每个工作进程先执行一个空任务，启动和预热都在服务开始接受请求之前完成
+        for future in [executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def _replace_pool(self, broken):
+        # 工作进程异常退出后进程池不能再使用（进程池已结束其余的工作进程，执行中的作业已记为失败），
+        # 换一个新的进程池。同时只有一个线程更换，其他线程等待后直接使用新的进程池
+        with self._pool_lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._start_pool()
+            return self._executor
+
+    def submit(self, kind, params, job_id=None):
+        """
+        提交作业，返回 (作业, 是否新建)
+
+        参数有误时抛出 ValueError，队列已满时抛出 ServiceBusy，作业ID冲突时抛出 JobConflict。
+        """
+        params = validate_params(kind, params)
+        if job_id is not None and not JOB_ID_PATTERN.fullmatch(str(job_id)):
+            raise ValueError("作业ID只能包含字母、数字、点、下划线和连字符，最长128个字符")
+        with self.condition:
+            if job_id is not None and job_id in self.jobs:
+                job = self.jobs[job_id]
+                if (job.kind, job.params) != (kind, params):
+                    raise JobConflict(f"作业ID {job_id} 已用于参数不同的作业")
+                self.counters['deduplicated'] += 1
+                return job, False
+            if self.closed:
+                raise ServiceBusy("服务正在关闭")
+            if self.active >= self.capacity:
+                self.counters['rejected'] += 1
+                raise ServiceBusy(f"队列已满（{self.active}/{self.capacity}）")
+
+            job = ServiceJob(job_id or uuid.uuid4().hex, kind, params)
+            self.jobs[job.id] = job
+            self.active += 1
+            self.counters['submitted'] += 1
+            self._evict()
+            executor = self._executor
+
+        # 在锁外交给进程池：更换进程池需要等待新的工作进程预热，期间 /health、/metrics 和查询不受影响
+        try:
+            try:
+                future = executor.submit(run_job, kind, params)
+            except BrokenProcessPool:
+                future = self._replace_pool(executor).submit(run_job, kind, params)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        job.future = future
+        future.add_done_callback(lambda future: self._finish(job, future))
+        return job, True
+
+    def _finish(self, job, future):
+        try:
+            result, error = future.result(), None
+        except Exception as e:
+            result, error = None, str(e) or type(e).__name__
+        with self.condition:
+            job.result, job.error, job.finished = result, error, time.time()
+            self.active -= 1
+            self.counters['failed' if error else 'completed'] += 1
+            self.latencies.append(job.finished - job.created)
+            if result:
+                self.run_seconds.append(result['seconds'])
+            self._evict()
+            self.condition.notify_all()
+
+    def _evict(self):
+        # 只淘汰已结束的作业，从最早提交的开始
+        excess = len(self.jobs) - self.active - self.max_finished
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished is not None][:max(0, excess)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def wait(self, job, timeout):
+        """等待作业结束，最多 timeout 秒，返回作业是否已结束"""
+        with self.condition:
+            return self.condition.wait_for(lambda: job.finished is not None, timeout)
+
+    def health(self):
+        with self.condition:
+            return {
+                'status': 'closing' if self.closed else 'ok',
+                'workers': self.workers,
+                'active': self.active,
+                'capacity': self.capacity,
+                'uptime': time.time() - self.started,
+            }
+
+    def metrics(self):
+        """计数器、当前排队和执行中的作业数，以及最近作业的总耗时（提交到结束）和执行耗时的百分位数"""
+        with self.condition:
+            statuses = [job.status for job in self.jobs.values() if job.finished is None]
+            metrics = dict(self.counters)
+            metrics.update({
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running'),
+                'capacity': self.capacity,
+                'workers': self.workers,
+                'uptime': time.time() - self.started,
+            })
+            for name, values in (('latency_seconds', list(self.latencies)), ('run_seconds', list(self.run_seconds))):
+                metrics[name] = {f"p{p}": percentile(values, p) for p in (50, 90, 99)}
+                metrics[name]['max'] = max(values, default=None)
+        return metrics
+
+    def close(self):
+        """不再接受新作业，等待已接受的作业执行完后关闭进程池"""
+        with self.condition:
+            self.closed = True
+        with self._pool_lock:
+            self._executor.shutdown(wait=True)
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    HTTP接口（JSON）
+
+    POST /convert、POST /merge  提交作业，请求体为作业参数，可带 job_id；
+                                新建返回202，已有同ID作业返回200，队列已满返回429（带 Retry-After）
+    GET  /jobs/<作业ID>         查询作业状态和结果
+    GET  /health、GET /metrics  健康检查和运行指标
+    提交和查询时都可以加 ?wait=秒数，等待作业结束后再返回（最多 MAX_WAIT_SECONDS 秒）。
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'WebpTools'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        service = self.server.service
+        if url.path == '/health':
+            self._send(HTTPStatus.OK, service.health())
+        elif url.path == '/metrics':
+            self._send(HTTPStatus.OK, service.metrics())
+        elif url.path.startswith('/jobs/'):
+            job = service.get(url.path[len('/jobs/'):])
+            if job is None:
+                self._send(HTTPStatus.NOT_FOUND, {'error': "找不到作业"})
+                return
+            self._wait(job, url)
+            self._send(HTTPStatus.OK, job.to_dict())
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {'error': f"未知的路径: {url.path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        kind = url.path.strip('/')
+        if kind not in JOB_PARAMETERS:
+            self._send(HTTPStatus.NOT_FOUND, {'error': f"未知的路径: {url.path}"})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "请求体过大"})
+            return
+        try:
+            params = json.loads(self.rfile.read(length) or b'{}')
+            job_id = params.pop('job_id', None) if isinstance(params, dict) else None
+            job, created = self.server.service.submit(kind, params, job_id)
+        except (ValueError, TypeError) as e:
+            self._send(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        except JobConflict as e:
+            self._send(HTTPStatus.CONFLICT, {'error': str(e)})
+            return
+        except ServiceBusy as e:
+            self._send(HTTPStatus.TOO_MANY_REQUESTS, {'error': str(e)}, {'Retry-After': '1'})
+            return
+        except Exception as e:
+            self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+            return
+        finished = self._wait(job, url)
+        self._send(HTTPStatus.OK if finished or not created else HTTPStatus.ACCEPTED, job.to_dict())
+
+    def _wait(self, job, url):
+        try:
+            timeout = float(parse_qs(url.query).get('wait', ['0'])[0])
+        except ValueError:
+            timeout = 0
+        if timeout > 0:
+            return self.server.service.wait(job, min(timeout, MAX_WAIT_SECONDS))
+        return job.finished is not None
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def create_server(host='127.0.0.1', port=8765, workers=None, queue_size=64, max_finished=1000, quiet=False):
+    """创建服务和HTTP服务器（进程池已预热），port 为0时由系统分配端口（见 server.server_address）"""
+    service = ConversionService(workers, queue_size, max_finished)
+    try:
+        server = ThreadingHTTPServer((host, port), ServiceHandler)
+    except Exception:
+        service.close()
+        raise
+    server.service = service
+    server.quiet = quiet
+    return server
+
+def serve(host='127.0.0.1', port=8765, workers=None, queue_size=64, max_finished=1000, quiet=False):
+    """运行服务直到 Ctrl+C 或 SIGTERM，停止时等待已接受的作业执行完"""
+    server = create_server(host, port, workers, queue_size, max_finished, quiet)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    host, port = server.server_address[:2]
+    print(f"转换服务已启动: http://{host}:{port}（{server.service.workers}个工作进程，"
+          f"最多同时接受{server.service.capacity}个作业，按 Ctrl+C 停止）", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止服务，等待已接受的作业完成...", flush=True)
+    finally:
+        server.server_close()
+        server.service.close()
+
+if __name__ == "__main__":
+    # 命令行参数统一在 webp_cli 中定义，python conversion_service.py ... 等同于 python webp_cli.py serve ...
+    from webp_cli import main
+    sys.exit(main(['serve'] + sys.argv[1:]))
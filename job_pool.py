@@ -0,0 +1,23 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+
+def job_executor(workers):
+    """根据进程数创建执行器，单进程时直接在当前进程中运行（None表示使用全部CPU核心）"""
+    if workers == 1:
+        return InlineExecutor()
+    return ProcessPoolExecutor(max_workers=workers)
+
+class InlineExecutor:
+    """与 ProcessPoolExecutor 接口一致的串行执行器"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
@@ -0,0 +1,65 @@
+from PIL import Image
+
+# Pillow解码后每像素占用的字节数（RGB和RGBA都按4字节存储）
+DECODED_BYTES_PER_PIXEL = 4
+# WEBP编码（method=6）时libwebp每像素额外占用的字节数（实测值，带透明通道时约为两倍）
+ENCODE_BYTES_PER_PIXEL = 10
+ENCODE_ALPHA_BYTES_PER_PIXEL = 20
+
+def image_info(path):
+    """只读取文件头，返回 (尺寸, 颜色模式)，不解码像素"""
+    with Image.open(path) as img:
+        return img.size, img.mode
+
+def encode_bytes_per_pixel(mode):
+    return ENCODE_ALPHA_BYTES_PER_PIXEL if 'A' in mode or mode == 'P' else ENCODE_BYTES_PER_PIXEL
+
+def conversion_peak(path, output_sizes, search_threads=1):
+    """
+    估计转换一张PNG时的峰值内存（字节）
+
+    源图片整幅解码（Pillow的PNG解码不支持按区域或缩小解码），各版本依次编码，
+    峰值为解码后的图片加上最大的一个版本的编码占用（并行试编码时按线程数计算）。
+    output_sizes(源图片尺寸) 返回各版本的输出尺寸列表。
+    """
+    (width, height), mode = image_info(path)
+    largest = max((w * h for w, h in output_sizes((width, height))), default=0)
+    return (width * height * DECODED_BYTES_PER_PIXEL
+            + largest * encode_bytes_per_pixel(mode) * max(1, search_threads))
+
+def merge_peak(source_sizes, output_size, low_memory=False):
+    """
+    估计合并一组图片时的峰值内存（字节）
+
+    source_sizes 为同时保留的各源图片尺寸。low_memory 时源图片逐张解码并立即缩小到输出尺寸，
+    整幅解码的图片同一时间只有一张；否则全部源图片同时保留，并在源分辨率上合成。
+    """
+    output_pixels = output_size[0] * output_size[1]
+    source_pixels = [width * height for width, height in source_sizes]
+    # 合成结果、缩放后的结果和编码占用
+    working = output_pixels * (2 * DECODED_BYTES_PER_PIXEL + ENCODE_ALPHA_BYTES_PER_PIXEL)
+    if low_memory:
+        return (max(source_pixels, default=0) * DECODED_BYTES_PER_PIXEL
+                + len(source_pixels) * output_pixels * DECODED_BYTES_PER_PIXEL + working)
+    # 另外还有缩放到左图尺寸的右图和源分辨率的合成画布
+    return (sum(source_pixels) + 2 * max(source_pixels, default=0)) * DECODED_BYTES_PER_PIXEL + working
+
+class MemoryBudget:
+    """
+    批量处理的内存预算：按估计的峰值内存决定能否再开始一个任务
+
+    limit_bytes 为None时不限制；正在进行的任务为空时总是允许开始（单个任务超出预算时单独运行）。
+    """
+
+    def __init__(self, limit_bytes=None):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+
+    def fits(self, need):
+        return self.limit_bytes is None or self.in_use == 0 or self.in_use + need <= self.limit_bytes
+
+    def acquire(self, need):
+        self.in_use += need
+
+    def release(self, need):
+        self.in_use -= need
@@ -1,99 +1,300 @@
-from PIL import Image, ImageDraw
-import math
+from PIL import Image
+import io
 import os
+import sys
+import csv
+import json
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
+
+from compositor import ASPECT_RATIO, compose_comparison, prepare_source, processing_size
+from job_pool import job_executor
+from memory_budget import MemoryBudget, image_info, merge_peak
+from rate_control import encode_to_budget, fits_search
+from webp_encoder import write_atomic
 
-def merge_images(image1_path, image2_path, output_path, final_width=960, target_size_kb=35):
+def merge_images(image1_path, image2_path, output_path, final_width=960, target_size_kb=35, predictor=None,
+                 prescale=False, max_trials=None, min_scale=1.0, low_memory=False):
+    """
+    合并两张图片并按目标大小保存为WEBP
+    
+    提供 predictor 时从预测的质量开始查找；prescale 为True时先缩放到输出尺寸再合成，
+    输入远大于输出时更快（误差范围见 compositor.compose_comparison）。
+    low_memory 为True时两张图片逐张解码并立即缩小到输出尺寸（同时启用 prescale），
+    整幅解码的图片同一时间只有一张，适合远大于输出的输入。
+    max_trials、min_scale 和返回值见 merge_decoded。
+    """
+    processing = None
+    if low_memory:
+        # 按左图的文件头确定处理尺寸
+        with Image.open(image1_path) as header:
+            processing = processing_size(header.width, final_width, prescale=True)
+        prescale = True
+    
     # 打开两张图片
-    img1 = Image.open(image1_path)
-    img2 = Image.open(image2_path)
-    
-    # 计算处理尺寸（保持原始宽高比）
-    aspect_ratio = 16/9
-    process_width = img1.width  # 使用原始宽度
-    process_height = int(process_width / aspect_ratio)
-    
-    # 调整图片高度以适应16:9（如果需要的话）
-    img1 = img1.resize((process_width, process_height))
-    img2 = img2.resize((process_width, process_height))
-    
-    # 创建最终图片
-    result = Image.new('RGBA', (process_width, process_height), (0, 0, 0, 0))
-    
-    # 定义斜线位置
-    split_x = process_width // 2  # 中心点
-    split_offset = int(process_width * 50/960)  # 按比例计算偏移
-    
-    # 计算偏移量（25%）
-    offset = int(process_width * 0.25)
-    
-    # 创建遮罩
-    mask = Image.new('L', (process_width, process_height), 0)
-    draw_mask = ImageDraw.Draw(mask)
-    
-    # 绘制斜线遮罩
-    draw_mask.polygon([
-        (split_x, 0),          # 顶部中点
-        (process_width, 0),    # 右上角
-        (process_width, process_height),  # 右下角
-        (split_x + split_offset, process_height)  # 底部中点偏右
-    ], fill=255)
-    
-    # 创建临时画布来放置图片
-    temp1 = Image.new('RGBA', (process_width, process_height), (0, 0, 0, 0))
-    temp2 = Image.new('RGBA', (process_width, process_height), (0, 0, 0, 0))
-    
-    # 将图片放到对应位置（向左和向右偏移）
-    temp1.paste(img1, (-offset, 0))  # 左图向左偏移
-    temp2.paste(img2, (offset, 0))   # 右图向右偏移
-    
-    # 合成图片
-    result = Image.composite(temp2, temp1, mask)
-    
-    # 添加白色分割线（增加线宽以适应高分辨率）
-    draw = ImageDraw.Draw(result)
-    line_width = max(3, int(process_width * 3/960))  # 根据分辨率调整线宽
-    draw.line(
-        [(split_x, 0), (split_x + split_offset, process_height)],
-        fill='white',
-        width=line_width
-    )
-    
-    # 最后才调整到目标尺寸
-    if process_width != final_width:
-        final_height = int(final_width / aspect_ratio)
-        result = result.resize((final_width, final_height), Image.Resampling.LANCZOS)
+    img1, file_size1, pixels1 = open_source(image1_path, processing)
+    img2, file_size2, pixels2 = open_source(image2_path, processing)
+    
+    # 源文件每像素字节数，用于质量预测
+    source_bytes_per_pixel = (file_size1 + file_size2) / (pixels1 + pixels2)
+    
+    return merge_decoded(img1, img2, output_path, final_width, target_size_kb, predictor, prescale,
+                         source_bytes_per_pixel, max_trials, min_scale)
+
+def open_source(path, processing=None):
+    """
+    解码一张源图片，返回 (图片, 源文件大小, 源图片像素数)
+    
+    processing 为 compositor.processing_size 的结果时立即缩小到处理尺寸，整幅解码的图片随即释放；
+    JPEG等支持缩小解码的格式直接按处理尺寸的两倍左右解码。
+    """
+    img = Image.open(path)
+    source_pixels = img.width * img.height
+    if processing:
+        size, resample = processing
+        if resample is not None:
+            img.draft(img.mode, (size[0] * 2, size[1] * 2))
+        img.load()
+        img = prepare_source(img, size, resample)
+    else:
+        img.load()
+    return img, os.path.getsize(path), source_pixels
 
-    # 二分法查找合适的质量参数
-    quality_min, quality_max = 50, 95
+def merge_decoded(img1, img2, output_path, final_width=960, target_size_kb=35, predictor=None, prescale=False,
+                  source_bytes_per_pixel=None, max_trials=None, min_scale=1.0):
+    """
+    合并两张已打开的图片并保存，源图片可以在多次合并之间复用
+    
+    max_trials 为试编码次数上限（可选）；min_scale 小于1时，最低质量仍超出目标大小的结果
+    缩小后重新查找（见 rate_control.encode_to_budget）。
+    返回 rate_control.RateResult（质量参数、试编码记录、与目标大小的偏差等）
+    """
+    # 合成对比图（斜线分割并缩放到目标尺寸）
+    result = compose_comparison(img1, img2, final_width, prescale)
+    
+    # 按目标大小查找合适的质量参数（在内存中试编码）
     target_size = target_size_kb * 1024  # 转换为字节
-    best_quality = quality_min
+    search = None
+    if predictor and source_bytes_per_pixel:
+        search = fits_search(lambda img, quality_min, quality_max, fits, keep, max_trials: predictor.search(
+            img, f"merge:{target_size_kb}", source_bytes_per_pixel, quality_min, quality_max, fits, keep=keep,
+            max_trials=max_trials))
+    rate = encode_to_budget(result, target_size, 50, 95, keep='fitting', max_trials=max_trials, min_scale=min_scale,
+                            search=search)
     
-    while quality_min <= quality_max:
-        current_quality = (quality_min + quality_max) // 2
-        
-        # 临时保存并检查文件大小
-        temp_output = output_path + '.temp'
-        result.save(temp_output, 'WEBP', quality=current_quality, method=6)
-        current_size = os.path.getsize(temp_output)
-        
-        # 删除临时文件
-        os.remove(temp_output)
+    # 直接写入找到的最佳结果，无需重新编码
+    write_atomic(output_path, rate.data)
+    return rate
+
+def read_manifest(manifest_path):
+    """
+    读取批量合并清单，支持CSV（需要表头）和JSONL
+    
+    每行包含 left、right、output，可选 width（默认960）和 target_kb（默认35）；
+    相对路径以清单文件所在目录为基准。manifest_path 为 '-' 时从标准输入读取，
+    相对路径以当前目录为基准，第一个非空行以 { 开头时按JSONL解析。
+    """
+    if str(manifest_path) == '-':
+        text = sys.stdin.read()
+        base_dir = Path('.')
+        is_jsonl = text.lstrip().startswith('{')
+    else:
+        manifest_path = Path(manifest_path)
+        base_dir = manifest_path.parent
+        with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+            text = f.read()
+        is_jsonl = manifest_path.suffix.lower() in ('.jsonl', '.json')
+    
+    if is_jsonl:
+        records = (json.loads(line) for line in text.splitlines() if line.strip())
+    else:
+        records = csv.DictReader(io.StringIO(text, newline=''))
+    
+    rows = []
+    for line_number, record in enumerate(records, 1):
+        try:
+            rows.append({
+                'row': line_number,
+                'left': str(base_dir / record['left']),
+                'right': str(base_dir / record['right']),
+                'output': str(base_dir / record['output']),
+                'width': int(record.get('width') or 960),
+                'target_kb': int(record.get('target_kb') or 35),
+            })
+        except (KeyError, ValueError, TypeError) as e:
+            raise Exception(f"清单第{line_number}行格式错误: {str(e)}")
+    return rows
+
+def merge_batch(manifest_path, workers=1, prescale=False, report_path=None, max_trials=None, min_scale=1.0,
+                low_memory=False, max_memory_mb=None, predictor=None):
+    """
+    按清单批量合并图片
+    
+    使用同一张源图片的行会尽量分到同一个任务中，每个任务内每张源图片只解码一次；
+    任务在进程池中并行执行。单行失败不影响其他行，每行的结果写入 report_path（JSONL，可选）。
+    max_trials、min_scale 见 merge_decoded，low_memory、predictor 见 merge_images。
+    max_memory_mb 为内存预算（可选）：按文件头估计每个任务的峰值内存，同时进行的任务不超出预算
+    （单个任务超出预算时单独运行）。
+    
+    返回每一行的结果列表 [{'row', 'output', 'seconds', 'quality', 'bytes', 'deviation', 'trials', 'error'}, ...]，
+    deviation 为与目标大小的相对偏差
+    """
+    rows = read_manifest(manifest_path)
+    workers = workers or os.cpu_count() or 1
+    groups = _group_rows(rows, workers)
+    
+    budget = MemoryBudget(max_memory_mb * 1024 * 1024 if max_memory_mb else None)
+    
+    started = time.perf_counter()
+    results = []
+    with job_executor(workers) as executor:
+        futures = []
+        running = {}
+        for group in groups:
+            need = _group_peak(group, low_memory) if max_memory_mb else 0
+            # 等待正在进行的任务完成，直到预算足够
+            while running and not budget.fits(need):
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    budget.release(running.pop(future))
+            budget.acquire(need)
+            future = executor.submit(_merge_group, group, prescale, max_trials, min_scale, low_memory, predictor)
+            running[future] = need
+            futures.append(future)
         
-        # 调整搜索范围
-        if current_size > target_size:
-            quality_max = current_quality - 1
-        else:
-            best_quality = current_quality
-            quality_min = current_quality + 1
-    
-    # 使用找到的最佳质量参数保存
-    result.save(output_path, 'WEBP', quality=best_quality, method=6)
+        for group, future in zip(groups, futures):
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                # 子进程异常退出等情况，整组记为失败
+                results.extend({'row': row['row'], 'output': row['output'], 'seconds': 0, 'quality': None,
+                                'bytes': None, 'deviation': None, 'trials': 0, 'error': str(e)} for row in group)
+    elapsed = time.perf_counter() - started
+    
+    results.sort(key=lambda result: result['row'])
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    
+    errors = [result for result in results if result['error']]
+    for result in errors:
+        print(f"合并失败 第{result['row']}行 {result['output']}: {result['error']}")
+    print(f"合并完成: {len(results) - len(errors)}个成功, {len(errors)}个失败, "
+          f"耗时 {elapsed:.1f}秒 ({len(results) / max(elapsed, 1e-6):.1f}张/秒)")
+    over_target = [result for result in results if result['deviation'] is not None and result['deviation'] > 0]
+    if over_target:
+        print(f"{len(over_target)}张未达到目标大小，最大超出 {max(r['deviation'] for r in over_target) * 100:.1f}%")
+    return results
+
+def _group_rows(rows, workers):
+    """
+    按共用的源图片把行分组（连通分量），使同一张图片尽量只在一个任务中解码
+    
+    单个分量过大时按行数切分，避免一个任务拖慢整个批次。
+    """
+    parent = {}
+    
+    def find(path):
+        parent.setdefault(path, path)
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+    
+    for row in rows:
+        parent[find(row['left'])] = find(row['right'])
+    
+    components = {}
+    for row in rows:
+        components.setdefault(find(row['left']), []).append(row)
+    
+    max_rows = max(1, math.ceil(len(rows) / (workers * 4)))
+    groups = []
+    for component in components.values():
+        for start in range(0, len(component), max_rows):
+            groups.append(component[start:start + max_rows])
+    # 大的任务先提交
+    groups.sort(key=len, reverse=True)
+    return groups
+
+def _group_peak(group, low_memory):
+    """按文件头估计一个任务的峰值内存（字节），读不到文件头的图片不计入"""
+    sizes = {}
+    for row in group:
+        for path in (row['left'], row['right']):
+            if path not in sizes:
+                try:
+                    sizes[path] = image_info(path)[0]
+                except Exception:
+                    sizes[path] = (0, 0)
+    final_width = max(row['width'] for row in group)
+    return merge_peak(sizes.values(), (final_width, int(final_width / ASPECT_RATIO)), low_memory)
+
+def _merge_group(group, prescale, max_trials=None, min_scale=1.0, low_memory=False, predictor=None):
+    """
+    在一个任务中合并一组行（可在子进程中运行），每张源图片只解码一次，用完即释放
+    
+    low_memory 时保留的是缩小到处理尺寸后的图片，按处理尺寸区分
+    """
+    # 每一行用到的源图片: (路径, 处理尺寸)
+    row_sources = []
+    for row in group:
+        processing = None
+        if low_memory:
+            try:
+                with Image.open(row['left']) as header:
+                    processing = processing_size(header.width, row['width'], prescale=True)
+            except Exception:
+                # 打不开的图片在合并这一行时再报告错误
+                pass
+        row_sources.append([(path, processing) for path in (row['left'], row['right'])])
+    
+    remaining = {}
+    for sources in row_sources:
+        for source in sources:
+            remaining[source] = remaining.get(source, 0) + 1
+    
+    decoded = {}
+    results = []
+    for row, sources in zip(group, row_sources):
+        started = time.perf_counter()
+        rate = None
+        error = None
+        try:
+            images = []
+            for source in sources:
+                if source not in decoded:
+                    decoded[source] = open_source(*source)
+                images.append(decoded[source])
+            (img1, file_size1, pixels1), (img2, file_size2, pixels2) = images
+            source_bytes_per_pixel = (file_size1 + file_size2) / (pixels1 + pixels2)
+            rate = merge_decoded(img1, img2, row['output'], row['width'], row['target_kb'], predictor,
+                                 prescale=prescale or low_memory, source_bytes_per_pixel=source_bytes_per_pixel,
+                                 max_trials=max_trials, min_scale=min_scale)
+        except Exception as e:
+            error = str(e)
+        finally:
+            for source in sources:
+                remaining[source] -= 1
+                if remaining[source] == 0:
+                    decoded.pop(source, None)
+        results.append({
+            'row': row['row'],
+            'output': row['output'],
+            'seconds': round(time.perf_counter() - started, 4),
+            'quality': rate.quality if rate else None,
+            'bytes': rate.bytes_out if rate else None,
+            'deviation': round(rate.deviation, 4) if rate else None,
+            'trials': len(rate.trials) if rate else 0,
+            'error': error,
+        })
+    return results
 
 # 使用示例
 if __name__ == "__main__":
-    merge_images(
-        'image1.png',
-        'image2.png',
-        'output.webp',
-        target_size_kb=35  # 目标大小为35KB
-    ) 
\ No newline at end of file
+    # 命令行参数统一在 webp_cli 中定义，python merge_images.py ... 等同于 python webp_cli.py merge ...
+    from webp_cli import main
+    sys.exit(main(['merge'] + sys.argv[1:]))
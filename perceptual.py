@@ -0,0 +1,173 @@
+import io
+import random
+import time
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # 感知质量查找需要NumPy，其他功能不受影响
+    np = None
+
+from webp_encoder import WEBP_METHOD, encode_webp
+
+# 评分时使用的像素数上限：图片更大时从中抽取同样多像素的方块，而不是整幅比较
+PROXY_PIXELS = 512 * 512
+# 抽样方块的边长（原分辨率，保留编码产生的块效应和振铃）
+TILE_SIZE = 64
+# SSIM 窗口为 8x8、步长为4（由 4x4 小块的和相加得到）
+BLOCK_SIZE = 4
+# SSIM 的稳定常数（像素值范围 0-255）
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+class PerceptualProxy:
+    """
+    源图片的评分代理：亮度（有透明通道时乘以不透明度）的抽样方块
+
+    源图片只在创建时处理一次；每次试编码解码后取相同位置的方块，用 score 与源图片比较。
+    图片不超过 PROXY_PIXELS 时比较整幅图片，否则在均匀网格的每格中取一个方块
+    （位置按图片尺寸确定的随机数抖动，同样尺寸的图片总是取相同位置）。
+    seconds 为创建代理和全部评分（包括解码）的累计耗时。
+    """
+
+    def __init__(self, img):
+        if np is None:
+            raise Exception("感知质量查找需要安装NumPy")
+        started = time.perf_counter()
+        self.size = img.size
+        self.boxes = tile_boxes(img.size)
+        self.reference = self._tiles(img)
+        self.seconds = time.perf_counter() - started
+
+    def _tiles(self, img):
+        if img.mode == 'P' and 'transparency' in img.info:
+            img = img.convert('RGBA')
+        # 先裁剪再转换，只处理抽样的像素
+        tiles = []
+        for box in self.boxes:
+            tile = img.crop(box) if box != (0, 0) + img.size else img
+            luma = np.asarray(tile.convert('L'), dtype=np.float64)
+            if 'A' in tile.getbands():
+                luma *= np.asarray(tile.getchannel('A'), dtype=np.float64) / 255
+            tiles.append(luma)
+        return tiles
+
+    def score(self, data):
+        """解码一次试编码（内存中的WEBP字节），返回与源图片的平均SSIM（1为完全相同）"""
+        started = time.perf_counter()
+        with Image.open(io.BytesIO(data)) as decoded:
+            decoded.load()
+            if decoded.size != self.size:
+                raise ValueError(f"解码尺寸 {decoded.size} 与源图片 {self.size} 不同")
+            tiles = self._tiles(decoded)
+        score = float(np.mean([ssim(reference, tile) for reference, tile in zip(self.reference, tiles)]))
+        self.seconds += time.perf_counter() - started
+        return score
+
+def tile_boxes(size, pixels=PROXY_PIXELS):
+    """
+    抽样区域列表 [(左, 上, 右, 下), ...]，边长都是 BLOCK_SIZE 的倍数
+
+    图片不超过 pixels 个像素时为整幅图片，否则为均匀网格每格中的一个 TILE_SIZE 方块（共约 pixels 个像素）。
+    """
+    width, height = size
+    if width * height <= pixels or width < TILE_SIZE or height < TILE_SIZE:
+        # 不足一个小块的边保留原尺寸
+        return [(0, 0, width - width % BLOCK_SIZE or width, height - height % BLOCK_SIZE or height)]
+
+    count = max(1, pixels // (TILE_SIZE * TILE_SIZE))
+    columns = max(1, min(width // TILE_SIZE, round((count * width / height) ** 0.5)))
+    rows = max(1, min(height // TILE_SIZE, count // columns))
+    cell_width, cell_height = width / columns, height / rows
+    rng = random.Random(f"{width}x{height}")
+    boxes = []
+    for row in range(rows):
+        for column in range(columns):
+            left = int(column * cell_width + rng.random() * max(0, cell_width - TILE_SIZE))
+            top = int(row * cell_height + rng.random() * max(0, cell_height - TILE_SIZE))
+            left, top = min(left, width - TILE_SIZE), min(top, height - TILE_SIZE)
+            boxes.append((left, top, left + TILE_SIZE, top + TILE_SIZE))
+    return boxes
+
+def ssim(x, y):
+    """
+    两个同样尺寸的灰度数组的平均SSIM
+
+    窗口为 8x8、步长为4：先求 4x4 小块的和，相邻 2x2 个小块相加即为一个窗口的和，
+    全部为数组运算，不逐像素循环。尺寸小于一个窗口时按整个区域计算。
+    """
+    height, width = x.shape
+    rows, columns = height // BLOCK_SIZE, width // BLOCK_SIZE
+    if rows < 2 or columns < 2:
+        return _ssim_from_moments(x.mean(), y.mean(), x.var(), y.var(), ((x - x.mean()) * (y - y.mean())).mean())
+
+    def window_means(values):
+        blocks = values[:rows * BLOCK_SIZE, :columns * BLOCK_SIZE].reshape(
+            rows, BLOCK_SIZE, columns, BLOCK_SIZE).sum(axis=(1, 3))
+        windows = blocks[:-1, :-1] + blocks[1:, :-1] + blocks[:-1, 1:] + blocks[1:, 1:]
+        return windows / (4 * BLOCK_SIZE * BLOCK_SIZE)
+
+    mean_x, mean_y = window_means(x), window_means(y)
+    variance_x = window_means(x * x) - mean_x * mean_x
+    variance_y = window_means(y * y) - mean_y * mean_y
+    covariance = window_means(x * y) - mean_x * mean_y
+    return float(np.mean(_ssim_from_moments(mean_x, mean_y, variance_x, variance_y, covariance)))
+
+def _ssim_from_moments(mean_x, mean_y, variance_x, variance_y, covariance):
+    return (((2 * mean_x * mean_y + SSIM_C1) * (2 * covariance + SSIM_C2))
+            / ((mean_x * mean_x + mean_y * mean_y + SSIM_C1) * (variance_x + variance_y + SSIM_C2)))
+
+def perceptual_search(img, target_score, quality_min, quality_max, max_trials=None, proxy=None,
+                      method=WEBP_METHOD, lossless=False):
+    """
+    查找评分不低于 target_score 的最低质量参数（即满足感知质量要求的最小文件）
+
+    每次试编码在内存中解码并与源图片的评分代理（PerceptualProxy）比较，假设评分随质量单调递增。
+    先试最低质量（界面截图等简单图片通常一次即满足），不满足时二分，区间两端都有评分后按评分做线性插值，
+    同一端连续两次被替换时改用二分（与 rate_control.interpolation_search 相同）。
+    全部不满足时使用 quality_max；max_trials 用完时使用已满足要求的最低质量，都不满足时使用最高的试编码质量。
+
+    返回:
+        (质量参数, 编码字节, 试编码记录[(质量, 大小), ...], 评分记录{质量: 评分})
+    """
+    if max_trials is not None:
+        max_trials = max(1, max_trials)
+    proxy = proxy or PerceptualProxy(img)
+    encoded = {}
+    scores = {}
+    trials = []
+
+    def trial(quality):
+        data = encode_webp(img, quality, method, lossless)
+        encoded[quality] = data
+        scores[quality] = proxy.score(data)
+        trials.append((quality, len(data)))
+        return scores[quality]
+
+    # low 为已知不满足的最高质量，high 为已知满足的最低质量（初始为越界的虚拟端点）
+    low, high = quality_min - 1, quality_max + 1
+    last_side = None
+    quality = quality_min
+    while high - low > 1 and (max_trials is None or len(trials) < max_trials):
+        side = 'high' if trial(quality) >= target_score else 'low'
+        if side == 'high':
+            high = quality
+        else:
+            low = quality
+        repeated_side = side == last_side
+        last_side = side
+        if high - low <= 1:
+            break
+
+        if repeated_side or low < quality_min or high > quality_max or scores[high] <= scores[low]:
+            # 两端还没有都试编码过、同一端连续被替换或评分不随质量增加时二分
+            quality = (low + high) // 2
+        else:
+            position = (target_score - scores[low]) / (scores[high] - scores[low])
+            quality = min(max(low + int(position * (high - low)), low + 1), high - 1)
+
+    # 收敛且全部不满足时 quality_max 已经试编码过，就是最高的试编码质量
+    passing = [quality for quality in encoded if scores[quality] >= target_score]
+    best_quality = min(passing) if passing else max(encoded)
+    return best_quality, encoded[best_quality], trials, scores
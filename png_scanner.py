@@ -0,0 +1,88 @@
+import os
+import time
+from pathlib import Path
+
+def scan_pngs(root, recursive=False, exclude=()):
+    """
+    惰性遍历目录中的PNG文件（扩展名不区分大小写）
+
+    使用 os.scandir 逐个目录读取，边扫描边产出，不需要先列出整棵目录树。
+    同一目录内按名称排序，保证每次扫描的顺序一致。
+
+    参数:
+        root: 要扫描的目录
+        recursive: 是否递归扫描子目录
+        exclude: 跳过的目录（例如位于输入目录内的输出目录）
+    """
+    excluded = {os.path.normcase(os.path.abspath(path)) for path in exclude}
+    pending_dirs = [os.path.abspath(root)]
+
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    if entry.name.lower().endswith('.png'):
+                        yield Path(entry.path)
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    if os.path.normcase(entry.path) not in excluded:
+                        subdirs.append(entry.path)
+            except OSError:
+                continue
+
+        # 倒序压栈，使子目录按名称顺序处理
+        pending_dirs.extend(reversed(subdirs))
+
+def watch_pngs(root, recursive=False, interval=2.0, exclude=(), stop_event=None):
+    """
+    轮询目录，持续产出新增或发生变化的PNG文件
+
+    每轮扫描记录文件的修改时间和大小快照，连续两轮快照相同才认为文件已写入完成，
+    已处理过且没有变化的文件不会再次产出。因此第一批结果总是空的，目录中已有的文件
+    在一个轮询间隔后的第二批中产出。
+
+    参数:
+        root: 要监视的目录
+        recursive: 是否递归监视子目录
+        interval: 轮询间隔（秒）
+        exclude: 跳过的目录
+        stop_event: threading.Event（可选），设置后停止监视
+
+    每轮产出一个文件列表（可能为空），调用方可以借此在空闲时处理其他事情。
+    """
+    processed = {}
+    previous = {}
+
+    while True:
+        current = {}
+        for png_file in scan_pngs(root, recursive, exclude):
+            try:
+                stat = png_file.stat()
+            except OSError:
+                continue
+            current[png_file] = (stat.st_mtime_ns, stat.st_size)
+
+        ready = [png_file for png_file, snapshot in current.items()
+                 if previous.get(png_file) == snapshot and processed.get(png_file) != snapshot]
+        for png_file in ready:
+            processed[png_file] = current[png_file]
+        # 文件被删除后不再保留记录，重新出现时按新文件处理
+        for png_file in list(processed):
+            if png_file not in current:
+                del processed[png_file]
+        previous = current
+
+        yield ready
+
+        if stop_event is not None:
+            if stop_event.wait(interval):
+                return
+        else:
+            time.sleep(interval)
@@ -1,204 +1,573 @@
 from PIL import Image
+import io
 import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import Future
 from pathlib import Path
 
-def convert_png_to_webp(input_path, output_path=None, min_quality=80, create_cropped=False, crop_ratio=4):
+from batch_journal import BatchJournal, source_stat
+from content_classifier import encode_auto
+from conversion_cache import ConversionCache
+from conversion_metrics import ConversionRecord, MetricsLog, OutputRecord, format_record, format_summary, summarize, timed
+from job_pool import job_executor
+from memory_budget import MemoryBudget, conversion_peak
+from png_scanner import scan_pngs, watch_pngs
+from variants import Variant, default_variants, render_variant
+from rate_control import RateResult, encode_to_budget, fits_search, interpolation_search, target_bytes
+from webp_encoder import remove_temp_files, write_atomic
+
+def convert_png_to_webp(input_path, output_path=None, min_quality=80, create_cropped=False, crop_ratio=4, workers=1,
+                        search_threads=1, cache_dir=None, cache_max_mb=1024, predictor=None, recursive=False,
+                        watch=False, watch_interval=2.0, cropped_target_kb=None, variants=None, metrics_file=None,
+                        quiet=False, target_ratio=0.5, max_trials=None, min_scale=1.0, max_memory_mb=None,
+                        target_score=None, journal_file=None, encoding='lossy'):
     """
     将PNG图片转换为WEBP格式，优先保证清晰度
     
     参数:
-        input_path: 输入PNG文件路径或目录
+        input_path: 输入PNG文件路径或目录，或PNG文件路径的列表（可迭代，可以边读边转换，例如从标准输入读取）。
+                    文件列表按批量处理，输出文件的位置与单个文件相同（指定输出目录时放在该目录，否则放在输入文件旁边）
         output_path: 输出路径（可选）
         min_quality: 最低质量限制（默认80，范围0-100）
         create_cropped: 是否创建中心裁剪版本（默认False）
         crop_ratio: 裁剪比率，原图的 1/n（默认为4）
+        workers: 批量处理时的并行进程数（默认1，None表示使用全部CPU核心）
+        search_threads: 单张图片质量搜索时并行试编码的线程数（默认1）
+        cache_dir: 转换缓存目录（可选），源文件和参数都未变化时跳过转换
+        cache_max_mb: 转换缓存的最大容量，单位MB（默认1024）
+        predictor: QualityPredictor 实例（可选），从预测的质量开始查找以减少编码次数
+        recursive: 批量处理时是否递归处理子目录（默认False）
+        watch: 是否持续监视输入目录，只转换新增或变化的文件（默认False）。每轮有文件转换时在这一轮完成后
+               输出这一轮的汇总，不保留之前各轮的转换记录
+        watch_interval: 监视模式的轮询间隔，单位秒（默认2）
+        cropped_target_kb: 裁剪版本的目标大小，单位KB（可选，默认按原图大小的比例估算）
+        variants: 输出版本列表（Variant，可选），指定时代替 create_cropped/crop_ratio，
+                  每张源图片只解码一次即可输出所有版本
+        metrics_file: 转换记录文件（JSONL，可选），每个文件一行，追加写入
+        quiet: 为True时不输出每个文件的结果，只输出失败信息和批量汇总
+        target_ratio: 未指定目标大小的版本以参考大小的这一比例为目标（默认0.5）
+        max_trials: 每个版本的试编码次数上限（可选）
+        min_scale: 最低质量仍超出目标大小时允许缩小到的比例（默认1，不缩小）
+        max_memory_mb: 批量处理的内存预算，单位MB（可选）。按文件头估计每个文件的峰值内存，
+                       同时转换的文件不超出预算（单个文件超出预算时单独转换）
+        target_score: 感知质量目标（SSIM，0-1，可选）。指定时未指定目标大小的版本不再按大小查找，
+                      而是选择评分达到该值的最小文件
+        encoding: 编码方式（默认'lossy'）。'auto' 时先按图片内容分类，界面截图、示意图等使用无损或近无损编码，
+                  无法判断时同时尝试无损编码和有损查找，选择满足要求的较小文件（见 content_classifier）
+        journal_file: 批量转换日志文件（可选，见 batch_journal）。记录每个转换完成的文件，再次运行时跳过
+                      源文件、参数和输出都未变化的文件；开始时删除输出目录中中断的写入留下的临时文件
+                      （同一个输出目录同时只能有一个使用日志的批量转换）
+    
+    返回:
+        转换记录（ConversionRecord）列表，批量处理时按提交顺序排列（监视模式下只包含最后一轮的记录）
     """
+    cache = ConversionCache(cache_dir, cache_max_mb * 1024 * 1024) if cache_dir else None
+    options = {'search_threads': search_threads, 'cache': cache, 'predictor': predictor,
+               'cropped_target_kb': cropped_target_kb, 'variants': variants, 'target_ratio': target_ratio,
+               'max_trials': max_trials, 'min_scale': min_scale, 'target_score': target_score, 'encoding': encoding}
+    
+    metrics = MetricsLog(metrics_file) if metrics_file else None
+    journal = None
+    records = []
+    
+    def report(record):
+        # 控制台输出只是转换记录的格式化
+        records.append(record)
+        if cache and not (record.error or record.cache_hit or record.resumed):
+            # 工作进程写入了缓存条目，按新增大小定期淘汰，不等整批结束
+            cache.added(record.bytes_out)
+        if metrics:
+            metrics.write(record)
+        if record.error or not quiet:
+            print(format_record(record))
+    
     try:
-        # 如果输入是目录，则批量处理
-        if os.path.isdir(input_path):
-            input_dir = Path(input_path)
-            # 如果没有指定输出路径，则在输入目录创建webp子目录
-            output_dir = Path(output_path) if output_path else input_dir / 'webp'
-            
-            # 确保输出目录存在
-            try:
-                output_dir.mkdir(parents=True, exist_ok=True)
-            except Exception as e:
-                raise Exception(f"无法创建输出目录 {output_dir}: {str(e)}")
+        is_file_list = not isinstance(input_path, (str, os.PathLike))
+        # 如果输入是目录或文件列表，则批量处理
+        if is_file_list or os.path.isdir(input_path):
+            if is_file_list:
+                batches = [(Path(path) for path in input_path)]
+                
+                def targets(png_file):
+                    return _single_targets(png_file, output_path, create_cropped)
+            else:
+                input_dir = Path(input_path)
+                # 如果没有指定输出路径，则在输入目录创建webp子目录
+                output_dir = Path(output_path) if output_path else input_dir / 'webp'
+                
+                # 确保输出目录存在
+                _ensure_output_dir(output_dir)
+                
+                # 边扫描边提交任务；同一目录按名称排序，并按提交顺序汇总结果，保证结果与进程数无关
+                input_root = Path(os.path.abspath(input_dir))
+                exclude = [output_dir]
+                if watch:
+                    batches = watch_pngs(input_dir, recursive, watch_interval, exclude)
+                    print(f"正在监视目录: {input_dir}（按 Ctrl+C 停止）")
+                else:
+                    batches = [scan_pngs(input_dir, recursive, exclude)]
+                
+                def targets(png_file):
+                    return _batch_targets(png_file, input_root, output_dir, create_cropped)
             
-            # 处理目录中的所有PNG文件
-            success_count = 0
-            error_count = 0
-            for png_file in input_dir.glob('*.png'):
+            started = time.perf_counter()
+            max_pending = (workers or os.cpu_count() or 1) * 2
+            budget = MemoryBudget(max_memory_mb * 1024 * 1024 if max_memory_mb else None)
+            output_variants = variants or default_variants(create_cropped, crop_ratio, cropped_target_kb)
+            if journal_file:
+                journal = BatchJournal(journal_file, _output_params(min_quality, output_variants, predictor,
+                                                                    target_ratio, max_trials, min_scale, target_score,
+                                                                    encoding))
+                if is_file_list:
+                    removed = remove_temp_files(output_path) if output_path else 0
+                else:
+                    removed = remove_temp_files(output_dir, recursive)
+                if removed:
+                    print(f"已删除{removed}个中断时留下的临时文件")
+            with job_executor(workers) as executor:
+                pending = deque()
+                
+                def collect(limit, need=0):
+                    # 汇总已完成的任务，未完成的任务超过 limit 个或内存预算不足时等待最早提交的任务；
+                    # 单个文件失败不影响其他文件
+                    while pending and (len(pending) > limit or pending[0][1].done() or not budget.fits(need)):
+                        done_need, future, stat = pending.popleft()
+                        budget.release(done_need)
+                        record = future.result()
+                        if journal and not record.resumed:
+                            journal.record(record, stat)
+                        report(record)
+                
+                def add_finished(record):
+                    # 不需要转换的文件（文件列表中找不到的文件、之前已完成的文件）仍按提交顺序汇总
+                    finished = Future()
+                    finished.set_result(record)
+                    pending.append((0, finished, None))
+                    collect(max_pending)
+                
                 try:
-                    webp_file = output_dir / f"{png_file.stem}.webp"
-                    cropped_webp_file = output_dir / f"{png_file.stem}_cropped.webp" if create_cropped else None
-                    convert_single_file(png_file, webp_file, min_quality, cropped_webp_file, crop_ratio)
-                    success_count += 1
-                except Exception as e:
-                    print(f"转换失败 {png_file.name}: {str(e)}")
-                    error_count += 1
+                    for batch in batches:
+                        if watch:
+                            started = time.perf_counter()
+                        for png_file in batch:
+                            try:
+                                webp_file, cropped_webp_file = targets(png_file)
+                            except Exception as e:
+                                add_finished(ConversionRecord(str(png_file), error=str(e)))
+                                continue
+                            stat = None
+                            if journal:
+                                stat = source_stat(png_file)
+                                outputs = _variant_outputs(webp_file, cropped_webp_file, crop_ratio, cropped_target_kb,
+                                                           variants)
+                                resumed = journal.completed(png_file, stat, [path for _, path in outputs])
+                                if resumed:
+                                    add_finished(resumed)
+                                    continue
+                            job = ((png_file, webp_file, min_quality, cropped_webp_file, crop_ratio), options)
+                            # 自动选择编码方式时无损编码可能与有损查找同时进行
+                            need = (_estimate_peak(png_file, output_variants, search_threads + (encoding != 'lossy'))
+                                    if max_memory_mb else 0)
+                            collect(max_pending, need)
+                            budget.acquire(need)
+                            pending.append((need, executor.submit(_convert_job, job), stat))
+                            collect(max_pending)
+                        collect(max_pending)
+                        if watch:
+                            # 监视模式下等这一轮的文件转换完成后单独汇总，之后清空转换记录，长时间运行时内存不会增长
+                            collect(0)
+                            if records:
+                                print(format_summary(summarize(records, time.perf_counter() - started)))
+                                records.clear()
+                except KeyboardInterrupt:
+                    if not watch:
+                        raise
+                    print("\n停止监视，等待正在进行的转换完成...")
+                collect(0)
             
-            if error_count > 0:
-                print(f"\n转换完成: {success_count}个成功, {error_count}个失败")
-            return
+            if cache:
+                cache.prune()
+            
+            if records or not watch:
+                print()
+                print(format_summary(summarize(records, time.perf_counter() - started)))
+            return records
                 
         else:
             # 处理单个文件
             input_file = Path(input_path)
-            if not input_file.exists():
-                raise Exception(f"找不到输入文件: {input_path}")
+            output_file, cropped_output_file = _single_targets(input_file, output_path, create_cropped)
             
-            if output_path:
-                output_dir = Path(output_path)
-                # 确保输出目录存在
-                try:
-                    output_dir.mkdir(parents=True, exist_ok=True)
-                except Exception as e:
-                    raise Exception(f"无法创建输出目录 {output_dir}: {str(e)}")
-                output_file = output_dir / f"{input_file.stem}.webp"
-                cropped_output_file = output_dir / f"{input_file.stem}_cropped.webp" if create_cropped else None
-            else:
-                output_file = input_file.with_suffix('.webp')
-                cropped_output_file = input_file.parent / f"{input_file.stem}_cropped.webp" if create_cropped else None
-            
-            convert_single_file(input_file, output_file, min_quality, cropped_output_file, crop_ratio)
+            report(convert_single_file(input_file, output_file, min_quality, cropped_output_file, crop_ratio,
+                                       **options))
+            if cache:
+                cache.prune()
+            return records
             
     except Exception as e:
         raise Exception(f"转换失败: {str(e)}")
+    finally:
+        if metrics:
+            metrics.close()
+        if journal:
+            journal.close()
+
+def conversion_targets(input_path, output_path=None, create_cropped=False, recursive=False):
+    """
+    按 convert_png_to_webp 的规则列出要转换的文件（惰性产出）
+    
+    产出 (输入文件, 输出文件, 裁剪版本输出文件或None)，需要时创建输出目录。
+    """
+    if os.path.isdir(input_path):
+        input_dir = Path(input_path)
+        output_dir = Path(output_path) if output_path else input_dir / 'webp'
+        _ensure_output_dir(output_dir)
+        input_root = Path(os.path.abspath(input_dir))
+        for png_file in scan_pngs(input_dir, recursive, [output_dir]):
+            yield (png_file, *_batch_targets(png_file, input_root, output_dir, create_cropped))
+    else:
+        input_file = Path(input_path)
+        yield (input_file, *_single_targets(input_file, output_path, create_cropped))
+
+def _ensure_output_dir(output_dir):
+    """确保输出目录存在"""
+    try:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    except Exception as e:
+        raise Exception(f"无法创建输出目录 {output_dir}: {str(e)}")
+
+def _batch_targets(png_file, input_root, output_dir, create_cropped):
+    """批量处理时的输出路径，递归处理时在输出目录中保持原有的子目录结构"""
+    target_dir = output_dir / png_file.parent.relative_to(input_root)
+    webp_file = target_dir / f"{png_file.stem}.webp"
+    cropped_webp_file = target_dir / f"{png_file.stem}_cropped.webp" if create_cropped else None
+    return webp_file, cropped_webp_file
+
+def _single_targets(input_file, output_path, create_cropped):
+    """单个文件的输出路径：指定输出目录时放在该目录，否则放在输入文件旁边"""
+    if not input_file.exists():
+        raise Exception(f"找不到输入文件: {input_file}")
+    
+    if output_path:
+        output_dir = Path(output_path)
+        _ensure_output_dir(output_dir)
+        output_file = output_dir / f"{input_file.stem}.webp"
+        cropped_output_file = output_dir / f"{input_file.stem}_cropped.webp" if create_cropped else None
+    else:
+        output_file = input_file.with_suffix('.webp')
+        cropped_output_file = input_file.parent / f"{input_file.stem}_cropped.webp" if create_cropped else None
+    return output_file, cropped_output_file
+
+def _estimate_peak(png_file, variants, search_threads):
+    """估计转换一个文件的峰值内存（字节），读不到文件头时返回0（转换时再报告错误）"""
+    try:
+        return conversion_peak(png_file, lambda size: [variant.output_size(size) for variant in variants],
+                               search_threads)
+    except Exception:
+        return 0
 
-def convert_single_file(input_file, output_file, min_quality, cropped_output_file=None, crop_ratio=4):
-    """转换单个文件"""
+def _convert_job(job):
+    """批量转换中的单个任务（可在子进程中运行），返回转换记录，失败时错误信息记录在 error 中"""
+    args, options = job
     try:
-        # 打开PNG图片
-        with Image.open(input_file) as img:
-            # 如果图片是RGBA模式但没有透明通道，转换为RGB
-            if img.mode == 'RGBA' and not has_transparency(img):
-                img = img.convert('RGB')
+        return convert_single_file(*args, **options)
+    except Exception as e:
+        return ConversionRecord(str(args[0]), error=str(e))
+
+def _variant_outputs(output_file, cropped_output_file, crop_ratio, cropped_target_kb, variants):
+    """
+    各输出版本及其输出路径 [(Variant, 路径), ...]
+    
+    未指定 variants 时为原图版本，提供 cropped_output_file 时加上中心裁剪版本；
+    指定 variants 时按各版本的名称在 output_file 旁生成对应文件。
+    """
+    if variants is not None:
+        return [(variant, variant.output_path(Path(output_file))) for variant in variants]
+    outputs = [(Variant(), output_file)]
+    if cropped_output_file:
+        outputs.append((Variant('cropped', crop_ratio=crop_ratio, target_kb=cropped_target_kb), cropped_output_file))
+    return outputs
+
+def _output_params(min_quality, variants, predictor, target_ratio, max_trials, min_scale, target_score, encoding):
+    """影响输出的转换参数（转换缓存的键和批量转换日志的参数指纹都由此计算）"""
+    return {
+        'min_quality': min_quality,
+        'variants': [variant.to_dict() for variant in variants],
+        'predicted_search': predictor is not None,
+        'target_ratio': target_ratio,
+        'max_trials': max_trials,
+        'min_scale': min_scale,
+        'target_score': target_score,
+        'encoding': encoding,
+    }
+
+def convert_single_file(input_file, output_file, min_quality, cropped_output_file=None, crop_ratio=4,
+                        search_threads=1, cache=None, predictor=None, cropped_target_kb=None, variants=None,
+                        target_ratio=0.5, max_trials=None, min_scale=1.0, target_score=None, encoding='lossy'):
+    """
+    转换单个文件，源图片只解码一次，输出所有版本
+    
+    未指定 variants 时输出原图版本，并在提供 cropped_output_file 时输出中心裁剪版本；
+    指定 variants（Variant 列表）时按各版本的名称在 output_file 旁生成对应文件。
+    提供 cache 时先查询转换缓存。target_ratio、max_trials、min_scale、target_score、encoding 见 save_optimized_webp。
+    返回转换记录（ConversionRecord）。
+    """
+    started = time.perf_counter()
+    record = ConversionRecord(str(input_file))
+    try:
+        outputs = _variant_outputs(output_file, cropped_output_file, crop_ratio, cropped_target_kb, variants)
+        
+        source = input_file
+        if cache:
+            # 读取一次源文件，同时用于计算缓存键和解码
+            with timed(record.timings, 'read'):
+                source_data = Path(input_file).read_bytes()
+            cache_key = cache.make_key(source_data, _output_params(
+                min_quality, [variant for variant, _ in outputs], predictor, target_ratio, max_trials, min_scale,
+                target_score, encoding))
+            record.bytes_in = len(source_data)
+            restored = cache.restore(cache_key, {variant.name: path for variant, path in outputs})
+            if restored is not None:
+                record.cache_hit = True
+                for variant, path in outputs:
+                    quality, output_encoding = restored[variant.name]
+                    record.add_output(OutputRecord(variant.name, str(path), quality=quality,
+                                                   bytes_out=os.path.getsize(path), encoding=output_encoding))
+                record.timings['total'] = time.perf_counter() - started
+                return record
+            source = io.BytesIO(source_data)
+        
+        # 打开PNG图片（只解码一次）
+        with Image.open(source) as img:
+            with timed(record.timings, 'decode'):
+                img.load()
+            record.decodes = 1
+            
+            # 没有透明像素的RGBA图片不再转换为RGB：WEBP编码时会省略全不透明的透明通道，
+            # 结果与转换后相同，省去一次整幅复制；质量预测时仍按RGB图片处理
+            with timed(record.timings, 'analyze'):
+                mode = 'RGB' if img.mode == 'RGBA' and not has_transparency(img) else img.mode
             
             # 获取原始文件大小
             original_size = os.path.getsize(input_file)
+            record.bytes_in = original_size
             
-            # 保存原始图片为WEBP
-            save_optimized_webp(img, output_file, min_quality, original_size)
-            
-            # 如果需要创建裁剪版本
-            if cropped_output_file:
-                create_cropped_version(img, cropped_output_file, min_quality, crop_ratio)
+            budget = {'target_ratio': target_ratio, 'max_trials': max_trials, 'min_scale': min_scale,
+                      'target_score': target_score, 'encoding': encoding}
+            for variant, path in outputs:
+                if variant.crop_ratio == 1 and not variant.width and not variant.target_kb:
+                    # 保存原始图片为WEBP，以源文件大小作为参考
+                    output = save_optimized_webp(img, path, min_quality, original_size, threads=search_threads,
+                                                 predictor=predictor, mode=mode, **budget)
+                else:
+                    output = save_variant(img, variant, path, min_quality, original_size, search_threads, predictor,
+                                          mode=mode, **budget)
+                record.add_output(output)
+        
+        if cache:
+            cache.store(cache_key, {output.variant: (output.path, output.quality, output.encoding)
+                                    for output in record.outputs})
+        
+        record.timings['total'] = time.perf_counter() - started
+        return record
             
     except Exception as e:
         raise Exception(f"处理文件失败: {str(e)}")
 
-def create_cropped_version(img, output_file, min_quality, crop_ratio=4):
-    """创建裁剪版本，裁剪为原图的 1/crop_ratio 大小"""
+def save_variant(img, variant, output_file, min_quality, parent_size=None, search_threads=1, predictor=None,
+                 target_size=None, mode=None, target_ratio=0.5, max_trials=None, min_scale=1.0, target_score=None,
+                 encoding='lossy'):
+    """
+    在已解码的图片上生成一个版本（裁剪、缩放）并保存为WEBP
+    
+    参考大小按该版本占原图的面积比例从 parent_size（原图的源文件大小）估算，无需重新编码PNG；
+    target_size 为目标字节数（可选，默认取 variant.target_kb），指定时直接按该大小查找质量参数；
+    mode、target_ratio、max_trials、min_scale、target_score、encoding 见 save_optimized_webp。
+    返回输出记录（OutputRecord）。
+    """
     try:
-        # 获取原始尺寸
-        width, height = img.size
+        timings = {}
+        with timed(timings, 'render'):
+            variant_img = render_variant(img, variant)
+        reference_size = estimate_reference_size(variant_img, parent_size, img.width * img.height)
+        if target_size is None and variant.target_kb:
+            target_size = variant.target_kb * 1024
+        output = save_optimized_webp(variant_img, output_file, min_quality, reference_size, threads=search_threads,
+                                     predictor=predictor, target_size=target_size, mode=mode,
+                                     target_ratio=target_ratio, max_trials=max_trials, min_scale=min_scale,
+                                     target_score=target_score, encoding=encoding)
         
-        # 计算裁剪区域（以中心点为基准）
-        target_width = width // crop_ratio
-        target_height = height // crop_ratio
-        left = (width - target_width) // 2
-        top = (height - target_height) // 2
-        right = left + target_width
-        bottom = top + target_height
-        
-        # 裁剪图片
-        cropped_img = img.crop((left, top, right, bottom))
-        
-        # 保存为WEBP
-        save_optimized_webp(cropped_img, output_file, min_quality)
-        
-        print(f"创建裁剪版本: {output_file}")
-        print(f"裁剪尺寸: {target_width}x{target_height} (原图的 1/{crop_ratio})")
-        print("-" * 50)
+        output.variant = variant.name
+        output.source_width, output.source_height = img.size
+        output.crop_ratio = variant.crop_ratio
+        output.scaled = bool(variant.width)
+        output.timings.update(timings)
+        return output
         
     except Exception as e:
-        raise Exception(f"创建裁剪版本失败: {str(e)}")
+        raise Exception(f"创建{variant.name}版本失败: {str(e)}")
 
-def save_optimized_webp(img, output_file, min_quality, original_size=None):
-    """使用二分查找寻找最佳质量参数并保存WEBP"""
-    # 使用二分查找寻找最佳质量参数
-    quality_min = min_quality
-    quality_max = 100
-    best_quality = quality_max
-    best_size = float('inf')
-    
-    # 确保输出文件的父目录存在
-    output_file.parent.mkdir(parents=True, exist_ok=True)
+def create_cropped_version(img, output_file, min_quality, crop_ratio=4, search_threads=1, predictor=None,
+                           parent_size=None, target_size=None):
+    """创建裁剪版本，裁剪为原图的 1/crop_ratio 大小，返回输出记录（OutputRecord）"""
+    return save_variant(img, Variant('cropped', crop_ratio=crop_ratio), output_file, min_quality, parent_size,
+                        search_threads, predictor, target_size)
+
+def save_optimized_webp(img, output_file, min_quality, original_size=None, threads=1, predictor=None,
+                        target_size=None, mode=None, target_ratio=0.5, max_trials=None, min_scale=1.0,
+                        target_score=None, encoding='lossy'):
+    """
+    按大小预算寻找最佳质量参数并保存WEBP（试编码全部在内存中进行，见 rate_control）
     
+    默认在大小-质量曲线上插值查找，编码次数比二分查找少；threads 大于1时在线程池中预先编码
+    下一步可能试编码的质量，试编码和结果都与串行完全相同。
+    提供 predictor 时先试编码预测的质量，预测准确时只需2-3次编码，结果与二分查找相同。
+    target_size 为目标字节数（可选），默认目标为原始大小的 target_ratio（默认50%）。
+    max_trials 为试编码次数上限（可选，指定时不并行预先编码）；min_scale 小于1时，最低质量仍超出目标的图片缩小后重新查找。
+    mode 为质量预测时使用的颜色模式（可选，默认取 img.mode），例如全不透明的RGBA图片按RGB处理。
+    target_score 为感知质量目标（SSIM，可选）：未指定 target_size 时不再按大小查找，而是每次试编码后
+    在内存中解码、与源图片的抽样方块比较，选择评分达到目标的最低质量（见 perceptual）。
+    encoding 为 'auto' 时按图片内容选择无损、近无损或有损编码（见 content_classifier.encode_auto），
+    无损候选满足目标大小（或感知质量目标）时不再进行有损查找。
+    返回输出记录（OutputRecord）。
+    """
+    timings = {}
     # 如果没有提供原始大小，使用当前图片的估计大小
     if original_size is None:
-        # 临时保存为PNG以获取大小估计
-        temp_png = str(output_file) + '.temp.png'
-        img.save(temp_png)
-        original_size = os.path.getsize(temp_png)
-        os.remove(temp_png)
-    
-    while quality_min <= quality_max:
-        current_quality = (quality_min + quality_max) // 2
-        
-        # 临时保存并检查文件大小
-        temp_output = str(output_file) + '.temp'
-        img.save(temp_output, 'WEBP', 
-                quality=current_quality, 
-                method=6,  # 最佳压缩方法
-                lossless=False)  # 使用有损压缩
-        
-        current_size = os.path.getsize(temp_output)
-        
-        # 如果当前结果更好，保存它
-        if current_size < best_size:
-            best_size = current_size
-            best_quality = current_quality
-            # 重命名临时文件为最终文件
-            try:
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-                os.rename(temp_output, output_file)
-            except Exception:
-                if os.path.exists(temp_output):
-                    os.remove(temp_output)
-                raise
+        original_size = estimate_reference_size(img)
+    
+    if target_score is not None and target_size is None:
+        return _save_perceptual_webp(img, output_file, min_quality, original_size, target_score, max_trials,
+                                     encoding)
+    
+    # 文件大于目标大小（默认为原文件的50%）时降低质量
+    if target_size is None:
+        target_size = target_bytes(original_size, ratio=target_ratio)
+        context = f"png:{min_quality}" if target_ratio == 0.5 else f"png:{min_quality}:x{target_ratio}"
+    else:
+        context = f"png:{min_quality}:{target_size}"
+    
+    if predictor:
+        bytes_per_pixel = original_size / (img.width * img.height)
+        search = fits_search(lambda img, quality_min, quality_max, fits, keep, max_trials: predictor.search(
+            img, context, bytes_per_pixel, quality_min, quality_max, fits, keep=keep, threads=threads, mode=mode,
+            max_trials=max_trials))
+    else:
+        def search(img, target_size, quality_min, quality_max, keep, max_trials, method, lossless):
+            return interpolation_search(img, target_size, quality_min, quality_max, keep, max_trials, method,
+                                        lossless, threads)
+    
+    def lossy():
+        return encode_to_budget(img, target_size, min_quality, 100, keep='smallest', max_trials=max_trials,
+                                min_scale=min_scale, search=search)
+    
+    checks, mismatches = (predictor.checks, predictor.mismatches) if predictor else (0, 0)
+    with timed(timings, 'encode'):
+        if encoding == 'auto':
+            result = encode_auto(img, lossy, lambda data: len(data) <= target_size)
         else:
-            if os.path.exists(temp_output):
-                os.remove(temp_output)
-        
-        # 调整搜索范围
-        if current_size > original_size * 0.5:  # 如果文件大于原文件的50%
-            quality_max = current_quality - 1
+            result = lossy()
+    if predictor:
+        # 本次查找中质量预测的校验结果（批量转换时在子进程中统计，随转换记录汇总）
+        checks, mismatches = predictor.checks - checks, predictor.mismatches - mismatches
+    
+    # 只写入一次最终文件
+    with timed(timings, 'write'):
+        write_atomic(output_file, result.data)
+    
+    width, height = result.size
+    return OutputRecord('full', str(output_file), width, height, img.width, img.height,
+                        quality=result.quality, reference_size=original_size, target_size=target_size,
+                        bytes_out=result.bytes_out, scale=result.scale, trials=len(result.trials),
+                        encoding=result.encoding, prediction_checks=checks, prediction_mismatches=mismatches,
+                        timings=timings)
+
+def _save_perceptual_webp(img, output_file, min_quality, original_size, target_score, max_trials=None,
+                          encoding='lossy'):
+    """按感知质量目标查找质量参数并保存WEBP，评分耗时单独记录为 score"""
+    # 感知质量查找需要NumPy，导入较慢，只在使用时导入
+    from perceptual import PerceptualProxy, perceptual_search
+    
+    timings = {}
+    # 已评分的编码结果 [(编码字节, 评分), ...]，选择编码方式时不重复解码
+    scored = []
+    
+    def lossy():
+        quality, data, trials, scores = perceptual_search(img, target_score, min_quality, 100, max_trials, proxy)
+        scored.append((data, scores[quality]))
+        return RateResult(quality, data, trials, img.size, 1.0, None)
+    
+    def score(data):
+        for known, value in scored:
+            if known is data:
+                return value
+        value = proxy.score(data)
+        scored.append((data, value))
+        return value
+    
+    with timed(timings, 'encode'):
+        proxy = PerceptualProxy(img)
+        if encoding == 'auto':
+            result = encode_auto(img, lossy, lambda data: score(data) >= target_score)
         else:
-            quality_min = current_quality + 1
-    
-    compression_ratio = (best_size / original_size) * 100
-    print(f"转换完成: {output_file}")
-    print(f"原始大小: {original_size/1024:.1f}KB")
-    print(f"转换后大小: {best_size/1024:.1f}KB")
-    print(f"压缩率: {compression_ratio:.1f}%")
-    print(f"使用的质量参数: {best_quality}")
-    print("-" * 50)
-
-def has_transparency(img):
-    """检查图片是否包含透明通道"""
-    if img.mode == 'RGBA':
-        extrema = img.getextrema()
-        if extrema[3][0] < 255:
+            result = lossy()
+        result_score = score(result.data)
+    timings['encode'] -= proxy.seconds
+    timings['score'] = proxy.seconds
+    
+    with timed(timings, 'write'):
+        write_atomic(output_file, result.data)
+    
+    return OutputRecord('full', str(output_file), img.width, img.height, img.width, img.height,
+                        quality=result.quality, reference_size=original_size, bytes_out=result.bytes_out,
+                        trials=len(result.trials), target_score=target_score, score=result_score,
+                        encoding=result.encoding, timings=timings)
+
+def estimate_reference_size(img, parent_size=None, parent_pixels=None):
+    """
+    估计图片作为PNG的大小，用作压缩目标的参考
+    
+    提供父图片的源文件大小和像素数时按面积比例分摊；否则对均匀分布的横条抽样，
+    在内存中用最快的PNG压缩级别编码后按行数放大，不需要对整张图片编码。
+    """
+    width, height = img.size
+    if parent_size and parent_pixels:
+        return max(1, round(parent_size * (width * height) / parent_pixels))
+    
+    strip_height = 8
+    strip_count = min(32, max(1, height // strip_height))
+    if strip_count * strip_height >= height:
+        sample = img
+    else:
+        step = height / strip_count
+        sample = Image.new(img.mode, (width, strip_count * strip_height))
+        if img.mode == 'P':
+            sample.putpalette(img.getpalette())
+        for i in range(strip_count):
+            top = int(i * step)
+            sample.paste(img.crop((0, top, width, top + strip_height)), (0, i * strip_height))
+    
+    buffer = io.BytesIO()
+    sample.save(buffer, 'PNG', compress_level=1)
+    return max(1, round(buffer.tell() * height / sample.height))
+
+def has_transparency(img, block_rows=256):
+    """
+    检查图片是否包含透明像素
+    
+    只取出一次透明通道（不复制RGB数据），再按 block_rows 行分块检查，遇到第一个含透明像素的块即返回。
+    """
+    if img.mode != 'RGBA':
+        return False
+    alpha = img.getchannel('A')
+    for top in range(0, img.height, block_rows):
+        if alpha.crop((0, top, img.width, min(top + block_rows, img.height))).getextrema()[0] < 255:
             return True
     return False
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("使用方法:")
-        print("1. 转换单个文件: python png_to_webp.py input.png [output.webp]")
-        print("2. 转换整个目录: python png_to_webp.py input_directory [output_directory]")
-        sys.exit(1)
-    
-    input_path = sys.argv[1]
-    output_path = sys.argv[2] if len(sys.argv) > 2 else None
-    
-    try:
-        convert_png_to_webp(input_path, output_path, create_cropped=True, crop_ratio=4)
-    except Exception as e:
-        print(f"错误: {str(e)}")
-        sys.exit(1) 
\ No newline at end of file
+    # 命令行参数统一在 webp_cli 中定义，python png_to_webp.py ... 等同于 python webp_cli.py convert ...
+    from webp_cli import main
+    sys.exit(main(['convert'] + sys.argv[1:]))
@@ -0,0 +1,168 @@
+import json
+import math
+from pathlib import Path
+
+from webp_encoder import quality_boundary, search_quality, search_quality_predicted, write_atomic
+
+DEFAULT_HISTORY_FILE = Path.home() / '.webp_tools_quality_history.jsonl'
+# 历史文件的行数超过保留记录数的这么多倍时重写文件，只保留每个场景最近的 max_samples 条
+HISTORY_COMPACT_FACTOR = 2
+
+class QualityPredictor:
+    """
+    根据历史转换结果预测质量参数
+
+    每次查找完成后把图片特征（尺寸、模式、源文件每像素字节数）和找到的质量边界
+    追加到 JSONL 历史文件中（多个进程可以同时追加），预测时取同一场景下
+    特征最接近的若干条历史记录做加权平均。
+    文件的行数超过保留记录数的 HISTORY_COMPACT_FACTOR 倍时重新读取并原子替换为只含保留记录的文件，
+    文件大小和每次启动时的读取量都有上限（重写期间其他进程追加的少量记录可能丢失，只影响预测）。
+    checks 和 mismatches 为本进程中校验（verify）的次数和预测查找与完整二分结果不一致的次数。
+    随作业传给工作进程时，同一个工作进程收到的副本共用一个实例，历史文件每个进程只读取一次。
+    """
+
+    def __init__(self, history_file=None, max_samples=5000, neighbors=8, verify=False):
+        """
+        参数:
+            history_file: 历史记录文件（默认 ~/.webp_tools_quality_history.jsonl）
+            max_samples: 每个场景保留的最近记录条数
+            neighbors: 预测时参考的最近邻数量
+            verify: 是否同时运行完整二分查找，检查预测查找的结果是否一致
+        """
+        self.history_file = Path(history_file) if history_file else DEFAULT_HISTORY_FILE
+        self.max_samples = max_samples
+        self.neighbors = neighbors
+        self.verify = verify
+        self.checks = 0
+        self.mismatches = 0
+        self._samples = None
+        self._lines = 0
+        self._save_failed = False
+
+    def search(self, img, context, bytes_per_pixel, quality_min, quality_max, fits, keep='smallest', threads=1,
+               mode=None, max_trials=None):
+        """
+        使用预测值查找质量参数，并把结果加入历史
+
+        没有可用的历史记录时退回完整二分查找（可使用 threads 并行试编码）。
+        mode 为特征中使用的颜色模式，默认取 img.mode。max_trials 为试编码次数上限（可选，校验用的完整二分不计入）。
+        返回值与 search_quality 相同。
+        """
+        width, height = img.size
+        mode = mode or img.mode
+        predicted = self.predict(context, width, height, mode, bytes_per_pixel)
+        if predicted is None:
+            best_quality, best_data, trials = search_quality(
+                img, quality_min, quality_max, fits, keep=keep, threads=threads, max_trials=max_trials)
+        else:
+            best_quality, best_data, trials = search_quality_predicted(
+                img, quality_min, quality_max, fits, predicted, keep=keep, max_trials=max_trials)
+            if self.verify:
+                bisection_quality = search_quality(img, quality_min, quality_max, fits, keep=keep, threads=threads,
+                                                   max_trials=max_trials)[0]
+                self.checks += 1
+                if bisection_quality != best_quality:
+                    self.mismatches += 1
+
+        # 记录质量边界而不是选中的质量：边界只由图片内容和要求决定，与查找路径无关
+        self.record(context, width, height, mode, bytes_per_pixel,
+                    quality_boundary(trials, fits, quality_min))
+        return best_quality, best_data, trials
+
+    def predict(self, context, width, height, mode, bytes_per_pixel):
+        """预测质量参数，没有该场景的历史记录时返回None"""
+        samples = self._load().get(context)
+        if not samples:
+            return None
+
+        target = _features(width, height, mode, bytes_per_pixel)
+        nearest = sorted(samples, key=lambda sample: _distance(sample, target))[:self.neighbors]
+        weights = [1 / (1e-3 + _distance(sample, target)) for sample in nearest]
+        quality = sum(w * sample['quality'] for w, sample in zip(weights, nearest)) / sum(weights)
+        return round(quality)
+
+    def record(self, context, width, height, mode, bytes_per_pixel, quality):
+        """记录一次查找结果，历史文件过大时重写（保存失败时只提示，不抛出异常）"""
+        sample = _features(width, height, mode, bytes_per_pixel)
+        sample.update({'context': context, 'quality': quality})
+
+        samples = self._load().setdefault(context, [])
+        samples.append(sample)
+        del samples[:-self.max_samples]
+
+        if self._save_failed:
+            return
+        try:
+            self.history_file.parent.mkdir(parents=True, exist_ok=True)
+            # 单行追加写入，多个进程同时写入也不会交错
+            with open(self.history_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(sample) + '\n')
+            self._lines += 1
+            kept = sum(len(context_samples) for context_samples in self._samples.values())
+            if self._lines > HISTORY_COMPACT_FACTOR * kept:
+                self._compact()
+        except OSError as e:
+            # 历史记录只用于加速查找，保存失败不影响转换：提示一次，本进程中不再写入
+            self._save_failed = True
+            print(f"警告: 保存质量历史失败，之后的结果不再记录: {str(e)}")
+
+    def _compact(self):
+        # 重新读取，包括其他进程追加的记录
+        self._samples, _ = self._read()
+        lines = [json.dumps(sample) + '\n' for samples in self._samples.values() for sample in samples]
+        write_atomic(self.history_file, ''.join(lines).encode('utf-8'))
+        self._lines = len(lines)
+
+    def _load(self):
+        if self._samples is None:
+            self._samples, self._lines = self._read()
+        return self._samples
+
+    def _read(self):
+        """读取历史文件，返回 ({场景: 最近的记录列表}, 文件行数)"""
+        samples = {}
+        lines = 0
+        try:
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        sample = json.loads(line)
+                        samples.setdefault(sample['context'], []).append(sample)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+        for context_samples in samples.values():
+            del context_samples[:-self.max_samples]
+        return samples, lines
+
+    def __reduce__(self):
+        # 传给子进程时只传参数，同一个进程收到的副本都是同一个实例，历史文件每个进程只读取一次
+        return _process_predictor, (str(self.history_file), self.max_samples, self.neighbors, self.verify)
+
+# 当前进程中按参数复用的 QualityPredictor（见 QualityPredictor.__reduce__）
+_process_predictors = {}
+
+def _process_predictor(history_file, max_samples, neighbors, verify):
+    key = (history_file, max_samples, neighbors, verify)
+    if key not in _process_predictors:
+        _process_predictors[key] = QualityPredictor(*key)
+    return _process_predictors[key]
+
+def _features(width, height, mode, bytes_per_pixel):
+    return {
+        'log_pixels': math.log2(max(width * height, 1)),
+        'aspect': math.log2(max(width, 1) / max(height, 1)),
+        'mode': mode,
+        'bpp': bytes_per_pixel,
+    }
+
+def _distance(sample, target):
+    """特征距离：每像素字节数最能反映内容复杂度，权重最高"""
+    distance = abs(sample['bpp'] - target['bpp']) * 4
+    distance += abs(sample['log_pixels'] - target['log_pixels']) * 0.5
+    distance += abs(sample['aspect'] - target['aspect']) * 0.25
+    if sample['mode'] != target['mode']:
+        distance += 1
+    return distance
@@ -0,0 +1,200 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image
+
+from webp_encoder import WEBP_METHOD, best_trial, bisection_choice, encode_webp
+
+# 回退到较小分辨率时，每轮至少缩小到原来的比例
+SCALE_STEP = 0.9
+
+def target_bytes(reference_size=None, target_kb=None, ratio=None):
+    """目标字节数：指定 target_kb 时按KB，否则为参考大小乘以 ratio"""
+    if target_kb:
+        return int(target_kb * 1024)
+    if ratio is None or not reference_size:
+        raise ValueError("需要指定目标大小（KB）或相对参考大小的比例")
+    return int(reference_size * ratio)
+
+@dataclass
+class RateResult:
+    """
+    按大小预算编码的结果
+
+    属性:
+        quality: 使用的质量参数
+        data: 编码结果（内存中的字节）
+        trials: 全部试编码记录 [(质量, 大小), ...]（包括回退到较小分辨率后的试编码）
+        size: 编码图片的尺寸 (宽, 高)
+        scale: 相对原图的缩放比例（未回退时为1）
+        target_size: 目标字节数（无损候选为None）
+        encoding: 编码方式，'lossy'、'lossless' 或 'near_lossless'（见 content_classifier）
+    """
+    quality: int
+    data: object
+    trials: list
+    size: tuple
+    scale: float
+    target_size: int
+    encoding: str = 'lossy'
+
+    @property
+    def bytes_out(self):
+        return len(self.data)
+
+    @property
+    def met(self):
+        """是否满足大小预算"""
+        return self.bytes_out <= self.target_size
+
+    @property
+    def deviation(self):
+        """与目标大小的相对偏差，例如 -0.03 表示比目标小3%"""
+        return self.bytes_out / self.target_size - 1
+
+def encode_to_budget(img, target_size, quality_min, quality_max, keep='fitting', max_trials=None, min_scale=1.0,
+                     search=None, method=WEBP_METHOD, lossless=False):
+    """
+    按大小预算编码图片，质量参数不够低时可回退到较小的分辨率
+
+    参数:
+        img: 要编码的图片
+        target_size: 目标字节数
+        quality_min, quality_max: 质量参数范围
+        keep: 候选保留策略，见 webp_encoder.search_quality
+        max_trials: 试编码次数上限（可选），包括回退后的试编码
+        min_scale: 允许回退到的最小缩放比例（默认1，不回退）。最低质量仍超出预算时，
+                   按“大小与像素数成正比”估算缩放比例后重新查找，直到满足预算或达到该比例
+        search: 查找函数（可选），签名与 interpolation_search 相同，默认为 interpolation_search
+
+    返回:
+        RateResult
+    """
+    search = search or interpolation_search
+    trials = []
+    scale = 1.0
+    current = img
+    while True:
+        remaining = None if max_trials is None else max(1, max_trials - len(trials))
+        quality, data, current_trials = search(current, target_size, quality_min, quality_max, keep, remaining,
+                                               method, lossless)
+        trials.extend(current_trials)
+        if (len(data) <= target_size or scale <= min_scale
+                or (max_trials is not None and len(trials) >= max_trials)):
+            return RateResult(quality, data, trials, current.size, scale, target_size)
+
+        # 编码大小约与像素数成正比，留出5%的余量
+        scale = max(min_scale, scale * min(SCALE_STEP, math.sqrt(target_size / len(data)) * 0.95))
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        current = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+def interpolation_search(img, target_size, quality_min, quality_max, keep='fitting', max_trials=None,
+                         method=WEBP_METHOD, lossless=False, threads=1):
+    """
+    在大小-质量曲线上插值查找满足 target_size 的最高质量（边界）
+
+    先按二分查找的路径试编码，直到两端都有试编码；之后按对数大小做线性插值（试位法），
+    同一端连续两次被替换时改用二分，避免收敛过慢。确定边界后返回 search_quality 二分查找
+    在该边界下会选中的质量（见 webp_encoder.bisection_choice，没有编码过时补充编码），
+    在“编码大小随质量单调递增”的前提下与二分查找的结果一致。
+
+    max_trials 用完时不再继续查找，按 webp_encoder.best_trial 从已有的试编码中选择。
+    threads 大于1且未限制 max_trials 时，每次试编码的同时在线程池中预先编码下一步可能试编码的质量
+    （两种结果下的下一个质量、相邻的质量和区间中点），查找路径、试编码记录和结果都与串行完全相同，
+    未用到的编码直接丢弃；返回前等待正在进行的预先编码结束，同时进行的编码不超过 threads 个。
+
+    返回:
+        (最佳质量参数, 最佳编码字节, 试编码记录[(质量, 大小), ...])
+    """
+    if max_trials is not None:
+        max_trials = max(1, max_trials)
+    encoded = {}
+    trials = []
+
+    executor = None
+    if threads > 1 and max_trials is None:
+        img.load()
+        executor = ThreadPoolExecutor(max_workers=threads)
+
+    # 线程池中已提交的编码 {质量: Future}，包括预先编码的质量
+    submitted = {}
+
+    def trial(quality, guesses=()):
+        if executor is None:
+            data = encode_webp(img, quality, method, lossless)
+        else:
+            # 已有 threads 个编码在进行时不再预先编码；save() 会在图片对象上写入 encoderinfo，
+            # 每个线程使用共享像素数据的独立包装对象
+            for q in [quality] + list(guesses):
+                running = sum(not future.done() for future in submitted.values())
+                if q not in submitted and (q == quality or running < threads):
+                    submitted[q] = executor.submit(encode_webp, img._new(img.im), q, method, lossless)
+            data = submitted[quality].result()
+        encoded[quality] = data
+        trials.append((quality, len(data)))
+        return len(data)
+
+    def exhausted():
+        return max_trials is not None and len(trials) >= max_trials
+
+    def guesses(quality):
+        # 试编码 quality 之后可能的下一个质量：满足预算时在 (quality, high) 中，否则在 (low, quality) 中
+        upper = [(quality + high) // 2 if high_size is None or last_side == 'low' else quality + 1,
+                 quality + 1, (quality + high) // 2]
+        lower = [(low + quality) // 2 if low_size is None or last_side == 'high' else quality - 1,
+                 quality - 1, (low + quality) // 2]
+        candidates = [upper[0], lower[0], upper[1], lower[1], upper[2], lower[2]]
+        return [q for q in candidates if low < q < high]
+
+    # low 为已知满足预算的最高质量，high 为已知超出预算的最低质量（初始为越界的虚拟端点）
+    low, high = quality_min - 1, quality_max + 1
+    low_size = high_size = None
+    last_side = None
+    repeated_side = False
+    quality = (quality_min + quality_max) // 2
+    try:
+        while high - low > 1 and not exhausted():
+            size = trial(quality, guesses(quality) if executor else ())
+            side = 'low' if size <= target_size else 'high'
+            if side == 'low':
+                low, low_size = quality, size
+            else:
+                high, high_size = quality, size
+            repeated_side = side == last_side
+            last_side = side
+            if high - low <= 1:
+                break
+
+            if low_size is None or high_size is None or repeated_side or high_size <= low_size:
+                # 还有一端没有试编码、同一端连续被替换，或大小不随质量增加（无法插值）时二分
+                quality = (low + high) // 2
+            else:
+                position = (math.log(target_size) - math.log(low_size)) / (math.log(high_size) - math.log(low_size))
+                quality = low + int(position * (high - low))
+            quality = min(max(quality, low + 1), high - 1)
+
+        if high - low <= 1:
+            best_quality = bisection_choice(quality_min, quality_max, low, keep)
+            if best_quality not in encoded and not exhausted():
+                trial(best_quality)
+    finally:
+        if executor is not None:
+            # 取消还没开始的预先编码，等待正在进行的编码结束，避免与下一张图片的编码争用CPU
+            executor.shutdown(cancel_futures=True)
+    # 试编码次数用完时区间可能还未收敛，直接从已有的试编码中选择
+    if high - low > 1 or best_quality not in encoded:
+        best_quality = best_trial(trials, lambda size: size <= target_size, keep)
+    return best_quality, encoded[best_quality], trials
+
+def fits_search(search):
+    """
+    把以 fits 函数为参数的查找函数包装为 encode_to_budget 使用的查找函数
+
+    search(img, quality_min, quality_max, fits, keep, max_trials) 返回值与 search_quality 相同；
+    包装后的函数忽略 method 和 lossless，例如并行二分查找和质量预测查找。
+    """
+    def wrapped(img, target_size, quality_min, quality_max, keep='fitting', max_trials=None, method=WEBP_METHOD,
+                lossless=False):
+        return search(img, quality_min, quality_max, lambda size: size <= target_size, keep, max_trials)
+    return wrapped
@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+from PIL import Image
+
+from batch_journal import BatchJournal, source_stat
+from conversion_metrics import ConversionRecord, OutputRecord
+from png_to_webp import convert_png_to_webp
+
+class BatchJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.input_dir = self.tmp / 'in'
+        self.output_dir = self.tmp / 'out'
+        self.journal_file = self.tmp / 'run.journal'
+        self.input_dir.mkdir()
+        for i in range(3):
+            Image.effect_noise((64, 48), 30 + i * 10).convert('RGB').save(self.input_dir / f'{i}.png')
+
+    def convert(self, **options):
+        with redirect_stdout(StringIO()):
+            return convert_png_to_webp(str(self.input_dir), str(self.output_dir), journal_file=str(self.journal_file),
+                                       quiet=True, **options)
+
+    def journal_record(self, source, output_file):
+        output_file.write_bytes(b'webp')
+        record = ConversionRecord(str(source))
+        record.outputs.append(OutputRecord('full', str(output_file), quality=85, bytes_out=4))
+        return record
+
+    def test_resume_skips_completed_files(self):
+        first = self.convert()
+        self.assertEqual([record.resumed for record in first], [False, False, False])
+        second = self.convert()
+        self.assertEqual([record.resumed for record in second], [True, True, True])
+        self.assertEqual([record.outputs[0].quality for record in second],
+                         [record.outputs[0].quality for record in first])
+
+    def test_reconverts_changed_source_params_or_output(self):
+        self.convert()
+        # 源文件变化
+        Image.effect_noise((64, 48), 90).convert('RGB').save(self.input_dir / '0.png')
+        # 输出被删除
+        os.remove(self.output_dir / '2.webp')
+        self.assertEqual([record.resumed for record in self.convert()], [False, True, False])
+        # 参数变化
+        self.assertEqual([record.resumed for record in self.convert(min_quality=90)], [False, False, False])
+
+    def test_torn_last_line_is_dropped(self):
+        source = self.input_dir / '0.png'
+        journal = BatchJournal(self.journal_file, {'min_quality': 80})
+        journal.record(self.journal_record(source, self.tmp / '0.webp'), source_stat(source))
+        # 进程在写下一行的中途被结束：不压缩、不关闭
+        journal.file.write('{"source": "' + str(self.input_dir / '1.png'))
+        journal.file.flush()
+
+        resumed = BatchJournal(self.journal_file, {'min_quality': 80})
+        try:
+            self.assertIsNotNone(resumed.completed(source, source_stat(source), [self.tmp / '0.webp']))
+            other = self.input_dir / '1.png'
+            self.assertIsNone(resumed.completed(other, source_stat(other), [self.tmp / '1.webp']))
+            resumed.record(self.journal_record(other, self.tmp / '1.webp'), source_stat(other))
+        finally:
+            resumed.file.close()
+            journal.file.close()
+
+        # 截掉写了一半的行后，之后追加的记录仍是完整的一行
+        with open(self.journal_file, encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([Path(line['source']).name for line in lines], ['0.png', '1.png'])
+
+    def test_compacted_index_survives_reopen(self):
+        with BatchJournal(self.journal_file, {'min_quality': 80}, compact_every=2) as journal:
+            for i in range(3):
+                source = self.input_dir / f'{i}.png'
+                journal.record(self.journal_record(source, self.tmp / f'{i}.webp'), source_stat(source))
+        self.assertEqual(os.path.getsize(self.journal_file), 0)
+
+        with BatchJournal(self.journal_file, {'min_quality': 80}) as journal:
+            for i in range(3):
+                source = self.input_dir / f'{i}.png'
+                self.assertIsNotNone(journal.completed(source, source_stat(source), [self.tmp / f'{i}.webp']))
+
+    def test_interrupted_writes_are_cleaned_up(self):
+        self.output_dir.mkdir()
+        leftovers = [self.output_dir / '0.webp.k3j2_x.temp', self.output_dir / '1.webp.temp',
+                     self.output_dir / '2.webp.temp.png']
+        for path in leftovers:
+            path.write_bytes(b'partial')
+        keep = self.output_dir / 'notes.temp'
+        keep.write_bytes(b'')
+
+        self.convert()
+        self.assertEqual([path.exists() for path in leftovers], [False, False, False])
+        self.assertTrue(keep.exists())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from unittest import mock
+
+from PIL import Image, ImageChops, ImageDraw
+
+import compositor
+from compositor import compose_comparison
+
+def reference_comparison(img1, img2, final_width=960):
+    """原先的合成方式：两张整幅的临时画布加整幅的多边形遮罩"""
+    aspect_ratio = 16/9
+    process_width = img1.width
+    process_height = int(process_width / aspect_ratio)
+    img1 = img1.resize((process_width, process_height))
+    img2 = img2.resize((process_width, process_height))
+
+    split_x = process_width // 2
+    split_offset = int(process_width * 50/960)
+    offset = int(process_width * 0.25)
+
+    mask = Image.new('L', (process_width, process_height), 0)
+    ImageDraw.Draw(mask).polygon([
+        (split_x, 0),
+        (process_width, 0),
+        (process_width, process_height),
+        (split_x + split_offset, process_height)
+    ], fill=255)
+
+    temp1 = Image.new('RGBA', (process_width, process_height), (0, 0, 0, 0))
+    temp2 = Image.new('RGBA', (process_width, process_height), (0, 0, 0, 0))
+    temp1.paste(img1, (-offset, 0))
+    temp2.paste(img2, (offset, 0))
+    result = Image.composite(temp2, temp1, mask)
+
+    draw = ImageDraw.Draw(result)
+    line_width = max(3, int(process_width * 3/960))
+    draw.line([(split_x, 0), (split_x + split_offset, process_height)], fill='white', width=line_width)
+
+    if process_width != final_width:
+        final_height = int(final_width / aspect_ratio)
+        result = result.resize((final_width, final_height), Image.Resampling.LANCZOS)
+    return result
+
+def noise(size, seed, mode='RGB'):
+    channels = [Image.effect_noise(size, 40 + seed * 7 + i) for i in range(len(mode))]
+    return Image.merge(mode, channels) if len(mode) > 1 else channels[0]
+
+class CompositorTest(unittest.TestCase):
+    # (左图尺寸, 右图尺寸, 输出宽度)：包括非16:9、两张图片尺寸不同、输出比输入大和宽度为奇数的情况
+    CASES = (
+        ((960, 540), (960, 540), 960),
+        ((1280, 720), (1280, 720), 960),
+        ((1001, 700), (640, 480), 960),
+        ((333, 190), (333, 190), 500),
+        ((97, 41), (120, 80), 64),
+    )
+
+    def inputs(self, size1, size2, mode):
+        img1 = noise(size1, 1, 'RGBA' if mode == 'RGBA' else 'RGB')
+        img2 = noise(size2, 2, 'RGBA' if mode == 'RGBA' else 'RGB')
+        if mode == 'P':
+            img1, img2 = img1.quantize(64), img2.quantize(64)
+        return img1, img2
+
+    def assert_identical(self, result, expected, case):
+        self.assertEqual((result.mode, result.size), (expected.mode, expected.size), case)
+        self.assertIsNone(ImageChops.difference(result, expected).getbbox(), case)
+
+    def test_matches_full_canvas_composite(self):
+        for size1, size2, final_width in self.CASES:
+            for mode in ('RGB', 'RGBA', 'P'):
+                img1, img2 = self.inputs(size1, size2, mode)
+                case = (size1, size2, final_width, mode)
+                self.assert_identical(compose_comparison(img1, img2, final_width),
+                                      reference_comparison(img1, img2, final_width), case)
+
+    def test_matches_without_numpy(self):
+        with mock.patch.object(compositor, 'np', None):
+            for size1, size2, final_width in self.CASES:
+                img1, img2 = self.inputs(size1, size2, 'RGB')
+                self.assert_identical(compose_comparison(img1, img2, final_width),
+                                      reference_comparison(img1, img2, final_width), (size1, size2, final_width))
+
+    def test_prescale_stays_close(self):
+        # 平滑的渐变图片，缩放算法的差异很小
+        img1 = Image.linear_gradient('L').resize((1920, 1080)).convert('RGB')
+        img2 = Image.radial_gradient('L').resize((1920, 1080)).convert('RGB')
+        result = compose_comparison(img1, img2, 960, prescale=True)
+        expected = reference_comparison(img1, img2, 960)
+        self.assertEqual(result.size, expected.size)
+
+        difference = ImageChops.difference(result.convert('RGB'), expected.convert('RGB')).convert('L')
+        histogram = difference.histogram()
+        mean_error = sum(value * count for value, count in enumerate(histogram)) / sum(histogram)
+        self.assertLess(mean_error, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from PIL import ImageFilter
+
+from benchmark import generate_image
+from content_classifier import classify_content, encode_auto
+from rate_control import RateResult
+
+SIZE = (640, 360)
+
+def screenshot_with_photo():
+    """界面截图的左侧四分之一换成照片：颜色很多，但仍有大片平坦区域"""
+    img = generate_image('ui', SIZE, 0)
+    img.paste(generate_image('photo', SIZE, 0).crop((0, 0, 160, SIZE[1])), (0, 0))
+    return img
+
+class ContentClassifierTest(unittest.TestCase):
+    def setUp(self):
+        self.lossy_calls = 0
+
+    def test_classify_synthetic_images(self):
+        cases = {
+            'photo': generate_image('photo', SIZE, 0),
+            'rgba_alpha': generate_image('rgba_alpha', SIZE, 0),
+            'ui': generate_image('ui', SIZE, 0),
+            'rgba_opaque': generate_image('rgba_opaque', SIZE, 0),
+            'blurred_ui': generate_image('ui', SIZE, 0).filter(ImageFilter.GaussianBlur(1)),
+            'ui_with_photo': screenshot_with_photo(),
+        }
+        expected = {'photo': 'lossy', 'rgba_alpha': 'lossy', 'ui': 'lossless', 'rgba_opaque': 'lossless',
+                    'blurred_ui': 'near_lossless', 'ui_with_photo': 'unsure'}
+        self.assertEqual({name: classify_content(img).decision for name, img in cases.items()}, expected)
+
+    def lossy_stub(self, img, size):
+        """固定大小的有损结果，记录是否进行了有损查找"""
+        def lossy():
+            self.lossy_calls += 1
+            return RateResult(80, bytes(size), [(80, size)], img.size, 1.0, size)
+        return lossy
+
+    def test_photo_uses_lossy_search_only(self):
+        img = generate_image('photo', SIZE, 0)
+        result = encode_auto(img, self.lossy_stub(img, 5000), lambda data: True)
+        self.assertEqual((result.encoding, result.quality, self.lossy_calls), ('lossy', 80, 1))
+
+    def test_screenshot_skips_lossy_search(self):
+        img = generate_image('ui', SIZE, 0)
+        result = encode_auto(img, self.lossy_stub(img, 5000), lambda data: len(data) <= 50000)
+        self.assertEqual((result.encoding, result.quality, self.lossy_calls), ('lossless', None, 0))
+        self.assertEqual(len(result.trials), 1)
+
+    def test_candidate_over_budget_falls_back_to_lossy(self):
+        img = generate_image('ui', SIZE, 0)
+        result = encode_auto(img, self.lossy_stub(img, 100), lambda data: len(data) <= 100)
+        self.assertEqual((result.encoding, result.bytes_out, self.lossy_calls), ('lossy', 100, 1))
+        # 无损候选的试编码也计入
+        self.assertEqual(len(result.trials), 2)
+
+    def test_blurred_screenshot_uses_near_lossless(self):
+        img = generate_image('ui', SIZE, 0).filter(ImageFilter.GaussianBlur(1))
+        result = encode_auto(img, self.lossy_stub(img, 10 ** 6), lambda data: len(data) <= 10 ** 6)
+        self.assertEqual((result.encoding, self.lossy_calls), ('near_lossless', 0))
+
+    def test_unsure_keeps_smaller_fitting_result(self):
+        img = screenshot_with_photo()
+        # 有损结果更小：两者都满足要求时取较小的一个
+        result = encode_auto(img, self.lossy_stub(img, 100), lambda data: True)
+        self.assertEqual((result.encoding, self.lossy_calls, len(result.trials)), ('lossy', 1, 2))
+        # 有损结果超出要求：取满足要求的无损结果
+        result = encode_auto(img, self.lossy_stub(img, 10 ** 7), lambda data: len(data) < 10 ** 7)
+        self.assertEqual((result.encoding, result.target_size), ('lossless', 10 ** 7))
+
+if __name__ == '__main__':
+    unittest.main()
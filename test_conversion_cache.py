@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+from conversion_cache import ConversionCache
+from png_to_webp import convert_png_to_webp
+
+class ConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache_dir = self.tmp / 'cache'
+        self.input_dir = self.tmp / 'in'
+        self.input_dir.mkdir()
+        for i in range(2):
+            Image.effect_noise((64, 48), 40 + i * 20).convert('RGB').save(self.input_dir / f'{i}.png')
+
+    def convert(self, **options):
+        with redirect_stdout(StringIO()):
+            return convert_png_to_webp(str(self.input_dir), str(self.tmp / 'out'), cache_dir=str(self.cache_dir),
+                                       quiet=True, **options)
+
+    def store(self, cache, key, size):
+        output_file = self.tmp / f'{key}.webp'
+        output_file.write_bytes(b'x' * size)
+        cache.store(key, {'full': (output_file, 80, 'lossy')})
+
+    def test_hit_and_miss(self):
+        first = self.convert()
+        self.assertEqual([record.cache_hit for record in first], [False, False])
+        second = self.convert()
+        self.assertEqual([record.cache_hit for record in second], [True, True])
+        self.assertEqual([record.outputs[0].quality for record in second],
+                         [record.outputs[0].quality for record in first])
+
+        # 参数变化时不命中
+        self.assertEqual([record.cache_hit for record in self.convert(min_quality=90)], [False, False])
+        # 源文件内容变化时不命中
+        Image.effect_noise((64, 48), 10).convert('RGB').save(self.input_dir / '0.png')
+        self.assertEqual([record.cache_hit for record in self.convert()], [False, True])
+
+    def test_stale_output_is_restored(self):
+        self.convert()
+        output_file = self.tmp / 'out' / '0.webp'
+        expected = output_file.read_bytes()
+        output_file.write_bytes(b'stale')
+
+        records = self.convert()
+        self.assertTrue(records[0].cache_hit)
+        self.assertEqual(output_file.read_bytes(), expected)
+
+    def test_entry_pruned_during_restore_is_a_miss(self):
+        cache = ConversionCache(self.cache_dir)
+        self.store(cache, 'ab' * 32, 100)
+        output_file = self.tmp / 'restored.webp'
+        # 其他进程在复制输出之后、更新访问时间之前淘汰了条目
+        with mock.patch('os.utime', side_effect=FileNotFoundError):
+            self.assertIsNone(cache.restore('ab' * 32, {'full': output_file}))
+        self.assertEqual(cache.restore('ab' * 32, {'full': output_file}), {'full': (80, 'lossy')})
+        self.assertIsNone(cache.restore('cd' * 32, {'full': output_file}))
+
+    def test_prune_removes_least_recently_used(self):
+        cache = ConversionCache(self.cache_dir, max_bytes=2500)
+        keys = [f'{i:02d}' * 32 for i in range(3)]
+        for i, key in enumerate(keys):
+            self.store(cache, key, 1000)
+            os.utime(self.cache_dir / key[:2] / key / 'entry.json', (1000 + i, 1000 + i))
+        # 最早保存的条目最近被使用过
+        self.assertIsNotNone(cache.restore(keys[0], {'full': self.tmp / 'restored.webp'}))
+
+        cache.prune()
+        remaining = [key for key in keys if (self.cache_dir / key[:2] / key).exists()]
+        self.assertEqual(remaining, [keys[0], keys[2]])
+
+    def test_added_prunes_periodically(self):
+        cache = ConversionCache(self.cache_dir, max_bytes=10000)
+        with mock.patch.object(cache, 'prune', wraps=cache.prune) as prune:
+            for _ in range(4):
+                cache.added(300)
+            self.assertEqual(prune.call_count, 1)
+            self.assertEqual(cache.added_bytes, 0)
+
+        # 批量转换中每个转换完成的文件都计入新增大小
+        with mock.patch.object(ConversionCache, 'prune', autospec=True) as prune:
+            self.convert(cache_max_mb=0)
+        self.assertGreaterEqual(prune.call_count, 3)
+
+if __name__ == '__main__':
+    unittest.main()
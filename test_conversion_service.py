@@ -0,0 +1,133 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from PIL import Image
+
+from conversion_service import create_server
+
+@unittest.skipUnless(hasattr(os, 'mkfifo'), "需要命名管道")
+class ConversionServiceTest(unittest.TestCase):
+    """在本机端口上运行服务（1个工作进程，不排队），用命名管道作为输入让作业停在读取源文件上"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), (200, 80, 40)).save(buffer, 'PNG')
+        cls.png = buffer.getvalue()
+        cls.input_path = os.path.join(cls.tmp, 'a.png')
+        with open(cls.input_path, 'wb') as f:
+            f.write(cls.png)
+
+        cls.server = create_server(port=0, workers=1, queue_size=0, quiet=True)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.server.service.close()
+        shutil.rmtree(cls.tmp)
+
+    def request(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.base + path, data), timeout=60) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            with e:
+                return e.code, json.load(e)
+
+    def convert_params(self, input_path, name):
+        # 指定目标大小：从管道读取时源文件大小为0，不能按源文件大小的比例计算目标
+        return {'input_path': input_path, 'output_path': os.path.join(self.tmp, name), 'variants': ['full:kb=20']}
+
+    def release(self, fifo):
+        # 作业已在读取管道时写入源图片；没有读取方（作业还没开始或已结束）时不阻塞
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            return False
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.png)
+        return True
+
+    def test_wait_returns_finished_job(self):
+        params = dict(self.convert_params(self.input_path, 'wait'), job_id='wait')
+        status, job = self.request('/convert?wait=60', params)
+        self.assertEqual(status, 200)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result']['failed'], 0)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'wait', 'a.webp')))
+
+        status, job = self.request('/jobs/wait')
+        self.assertEqual((status, job['status']), (200, 'done'))
+        self.assertEqual(self.request('/jobs/missing')[0], 404)
+
+    def test_dedup_conflict_and_backpressure(self):
+        fifo = os.path.join(self.tmp, 'blocked.png')
+        os.mkfifo(fifo)
+        params = self.convert_params(fifo, 'blocked')
+        try:
+            status, job = self.request('/convert', dict(params, job_id='blocked'))
+            self.assertEqual(status, 202)
+            self.assertIn(job['status'], ('queued', 'running'))
+
+            # 同一个作业ID、同样的参数：返回已有作业，不重复执行
+            status, job = self.request('/convert', dict(params, job_id='blocked'))
+            self.assertEqual((status, job['job_id']), (200, 'blocked'))
+            self.assertIsNone(job['finished'])
+
+            # 同一个作业ID、不同的参数
+            status, _ = self.request('/convert', dict(params, job_id='blocked', min_quality=90))
+            self.assertEqual(status, 409)
+
+            # 容量为1，正在执行的作业占满后拒绝新作业
+            status, body = self.request('/convert', self.convert_params(self.input_path, 'rejected'))
+            self.assertEqual(status, 429)
+            self.assertIn('error', body)
+            self.assertGreaterEqual(self.request('/metrics')[1]['rejected'], 1)
+
+            # 作业开始读取管道后写入源图片，等待作业结束
+            for _ in range(600):
+                if self.release(fifo):
+                    break
+                time.sleep(0.1)
+            status, job = self.request('/jobs/blocked?wait=60')
+            self.assertEqual((status, job['status']), (200, 'done'))
+        finally:
+            self.release(fifo)
+
+        # 作业结束后再次提交同一个ID仍返回已结束的作业
+        status, job = self.request('/convert', dict(params, job_id='blocked'))
+        self.assertEqual((status, job['status']), (200, 'done'))
+
+    def test_health_and_metrics(self):
+        status, health = self.request('/health')
+        self.assertEqual(status, 200)
+        self.assertEqual(health['status'], 'ok')
+        self.assertEqual((health['workers'], health['capacity']), (1, 1))
+
+        status, metrics = self.request('/metrics')
+        self.assertEqual(status, 200)
+        for name in ('submitted', 'deduplicated', 'rejected', 'completed', 'failed', 'queued', 'running'):
+            self.assertIsInstance(metrics[name], int)
+        self.assertEqual(set(metrics['latency_seconds']), {'p50', 'p90', 'p99', 'max'})
+
+    def test_invalid_request(self):
+        self.assertEqual(self.request('/convert', {'output_path': self.tmp})[0], 400)
+        self.assertEqual(self.request('/convert', {'input_path': self.input_path, 'job_id': 'bad id'})[0], 400)
+        self.assertEqual(self.request('/unknown')[0], 404)
+
+if __name__ == '__main__':
+    unittest.main()
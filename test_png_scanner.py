@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+import png_to_webp
+from png_scanner import scan_pngs, watch_pngs
+
+class PngScannerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def save_png(self, path, seed=40):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.effect_noise((32, 24), seed).convert('RGB').save(path)
+
+    def test_scan_sorted_recursive_and_excluded(self):
+        for name in ('b.png', 'a.PNG', 'sub/d.png', 'webp/e.png'):
+            self.save_png(self.tmp / name)
+        (self.tmp / 'c.txt').write_text('')
+        names = [path.relative_to(self.tmp).as_posix() for path in scan_pngs(self.tmp)]
+        self.assertEqual(names, ['a.PNG', 'b.png'])
+        names = [path.relative_to(self.tmp).as_posix()
+                 for path in scan_pngs(self.tmp, recursive=True, exclude=[self.tmp / 'webp'])]
+        self.assertEqual(names, ['a.PNG', 'b.png', 'sub/d.png'])
+
+    def test_watch_yields_existing_files_after_one_interval(self):
+        self.save_png(self.tmp / 'a.png')
+        batches = watch_pngs(self.tmp, interval=0, stop_event=threading.Event())
+        self.assertEqual(next(batches), [])
+        self.assertEqual(next(batches), [self.tmp / 'a.png'])
+        self.assertEqual(next(batches), [])
+
+        # 变化的文件在快照稳定后再次产出
+        self.save_png(self.tmp / 'a.png', seed=90)
+        os.utime(self.tmp / 'a.png', ns=(1, 1))
+        self.assertEqual(next(batches), [])
+        self.assertEqual(next(batches), [self.tmp / 'a.png'])
+
+    def test_watch_mode_summarizes_each_poll(self):
+        input_dir = self.tmp / 'in'
+        for i in range(3):
+            self.save_png(input_dir / f'{i}.png', seed=30 + i)
+
+        def polls(*args, **kwargs):
+            yield [input_dir / '0.png', input_dir / '1.png']
+            yield []
+            yield [input_dir / '2.png']
+            raise KeyboardInterrupt
+
+        with mock.patch.object(png_to_webp, 'watch_pngs', polls), redirect_stdout(StringIO()) as output:
+            records = png_to_webp.convert_png_to_webp(str(input_dir), str(self.tmp / 'out'), watch=True, quiet=True)
+        # 每轮单独汇总，不保留之前各轮的记录
+        self.assertEqual(output.getvalue().count("转换完成: "), 2)
+        self.assertIn("转换完成: 2个成功", output.getvalue())
+        self.assertEqual(records, [])
+        self.assertTrue((self.tmp / 'out' / '2.webp').exists())
+
+if __name__ == '__main__':
+    unittest.main()
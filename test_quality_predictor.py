@@ -0,0 +1,56 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import mock
+
+from quality_predictor import QualityPredictor
+
+class QualityPredictorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.history_file = os.path.join(self.tmp, 'history.jsonl')
+
+    def test_predicts_from_recorded_history(self):
+        predictor = QualityPredictor(self.history_file)
+        self.assertIsNone(predictor.predict('png:80', 640, 360, 'RGB', 1.0))
+        predictor.record('png:80', 640, 360, 'RGB', 1.0, 86)
+
+        # 新实例从历史文件读取
+        self.assertEqual(QualityPredictor(self.history_file).predict('png:80', 640, 360, 'RGB', 1.0), 86)
+
+    def test_history_file_is_compacted(self):
+        predictor = QualityPredictor(self.history_file, max_samples=10)
+        for i in range(100):
+            predictor.record('png:80', 640, 360, 'RGB', 1.0, 80 + i % 10)
+        with open(self.history_file, encoding='utf-8') as f:
+            self.assertLessEqual(len(f.readlines()), 2 * 10)
+
+    def test_unwritable_history_does_not_fail(self):
+        blocker = os.path.join(self.tmp, 'file')
+        open(blocker, 'w').close()
+        # 历史文件所在的“目录”是普通文件，无法创建
+        predictor = QualityPredictor(os.path.join(blocker, 'history.jsonl'))
+        with redirect_stdout(StringIO()) as output:
+            predictor.record('png:80', 640, 360, 'RGB', 1.0, 86)
+            predictor.record('png:80', 640, 360, 'RGB', 1.0, 86)
+        self.assertEqual(output.getvalue().count("保存质量历史失败"), 1)
+        self.assertEqual(predictor.predict('png:80', 640, 360, 'RGB', 1.0), 86)
+
+    def test_copies_in_one_process_read_history_once(self):
+        QualityPredictor(self.history_file).record('png:80', 640, 360, 'RGB', 1.0, 86)
+        predictor = QualityPredictor(self.history_file, max_samples=50)
+        with mock.patch.object(QualityPredictor, '_read', autospec=True, side_effect=QualityPredictor._read) as read:
+            # 与随作业传给工作进程时相同，每个作业各自反序列化一个副本
+            copies = [pickle.loads(pickle.dumps(predictor)) for _ in range(5)]
+            for copy in copies:
+                self.assertEqual(copy.predict('png:80', 640, 360, 'RGB', 1.0), 86)
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual(copies[0].max_samples, 50)
+
+if __name__ == '__main__':
+    unittest.main()
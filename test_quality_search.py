@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import rate_control
+import webp_encoder
+from rate_control import interpolation_search
+from webp_encoder import search_quality, search_quality_predicted
+
+class QualitySearchTest(unittest.TestCase):
+    """用按质量返回固定大小的编码函数代替WEBP编码，检查各种查找方式与串行二分查找选中同一个质量"""
+
+    # (最低质量, 最高质量)
+    RANGES = ((80, 100), (50, 95))
+
+    def setUp(self):
+        self.img = Image.new('RGB', (4, 4))
+        self.encodes = []
+        self.sizes = None
+        for module in (webp_encoder, rate_control):
+            patcher = mock.patch.object(module, 'encode_webp', self.encode)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def encode(self, img, quality, method=webp_encoder.WEBP_METHOD, lossless=False):
+        self.encodes.append(quality)
+        return bytes(self.sizes(quality))
+
+    def cases(self):
+        """(大小曲线, 最低质量, 最高质量, 目标字节数, keep)，大小随质量单调递增"""
+        curves = (lambda q: int(1000 * 1.05 ** q), lambda q: 5000 + 40 * q + q * q)
+        for curve in curves:
+            for quality_min, quality_max in self.RANGES:
+                # 目标从全部超出到全部满足
+                for quality in range(quality_min - 1, quality_max + 2):
+                    for keep in ('smallest', 'fitting'):
+                        yield curve, quality_min, quality_max, curve(quality), keep
+
+    def bisection(self, quality_min, quality_max, target_size, keep):
+        self.encodes = []
+        quality, data, trials = search_quality(self.img, quality_min, quality_max, lambda size: size <= target_size,
+                                               keep=keep)
+        self.assertEqual(len(data), self.sizes(quality))
+        return quality, len(self.encodes)
+
+    def test_parallel_bisection_matches_serial(self):
+        for curve, quality_min, quality_max, target_size, keep in self.cases():
+            self.sizes = curve
+            expected, _ = self.bisection(quality_min, quality_max, target_size, keep)
+            for threads in (2, 3, 4):
+                quality, _, _ = search_quality(self.img, quality_min, quality_max, lambda size: size <= target_size,
+                                               keep=keep, threads=threads)
+                self.assertEqual(quality, expected, (quality_min, quality_max, target_size, keep, threads))
+
+    def test_interpolation_matches_bisection(self):
+        for curve, quality_min, quality_max, target_size, keep in self.cases():
+            self.sizes = curve
+            expected, bisection_encodes = self.bisection(quality_min, quality_max, target_size, keep)
+            for threads in (1, 3):
+                self.encodes = []
+                quality, data, trials = interpolation_search(self.img, target_size, quality_min, quality_max, keep,
+                                                             threads=threads)
+                self.assertEqual(quality, expected, (quality_min, quality_max, target_size, keep, threads))
+                self.assertEqual(len(data), curve(quality))
+                if threads == 1:
+                    self.assertLessEqual(len(trials), bisection_encodes + 2)
+
+    def test_prediction_matches_bisection(self):
+        for curve, quality_min, quality_max, target_size, keep in self.cases():
+            self.sizes = curve
+            expected, bisection_encodes = self.bisection(quality_min, quality_max, target_size, keep)
+            boundary = max((q for q in range(quality_min, quality_max + 1) if curve(q) <= target_size),
+                           default=quality_min - 1)
+            # 准确的预测、偏差几级的预测以及范围两端
+            for predicted in {boundary, boundary - 1, boundary + 1, boundary - 6, boundary + 9,
+                              quality_min, quality_max}:
+                self.encodes = []
+                quality, data, trials = search_quality_predicted(
+                    self.img, quality_min, quality_max, lambda size: size <= target_size, predicted, keep=keep)
+                case = (quality_min, quality_max, target_size, keep, predicted)
+                self.assertEqual(quality, expected, case)
+                self.assertEqual(len(data), curve(quality))
+                self.assertEqual(len(trials), len(self.encodes))
+                self.assertLessEqual(len(trials), bisection_encodes + 2, case)
+                if predicted == boundary:
+                    self.assertLessEqual(len(trials), 3, case)
+
+    def test_max_trials_caps_encodes(self):
+        self.sizes = lambda q: 5000 + 40 * q + q * q
+        target_size = self.sizes(87)
+        fits = lambda size: size <= target_size
+        for max_trials in (1, 2, 3):
+            searches = (
+                lambda: search_quality(self.img, 80, 100, fits, threads=4, max_trials=max_trials),
+                lambda: interpolation_search(self.img, target_size, 80, 100, 'smallest', max_trials, threads=4),
+                lambda: search_quality_predicted(self.img, 80, 100, fits, 95, max_trials=max_trials),
+            )
+            for search in searches:
+                self.encodes = []
+                quality, data, trials = search()
+                self.assertLessEqual(len(self.encodes), max_trials)
+                self.assertEqual(len(data), self.sizes(quality))
+
+if __name__ == '__main__':
+    unittest.main()
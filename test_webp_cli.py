@@ -0,0 +1,31 @@
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from benchmark import CASES
+from webp_cli import build_parser
+
+class WebpCliTest(unittest.TestCase):
+    def help_text(self, *argv):
+        with redirect_stdout(StringIO()) as output, self.assertRaises(SystemExit):
+            build_parser().parse_args([*argv, '--help'])
+        return ' '.join(output.getvalue().split())
+
+    def test_bench_help_lists_every_case(self):
+        self.assertIn("默认全部: " + ' '.join(CASES), self.help_text('bench'))
+
+    def test_merge_accepts_predictor_options(self):
+        args = build_parser().parse_args(['merge', 'a.png', 'b.png', 'out.webp', '--predict', 'history.jsonl',
+                                          '--verify-prediction'])
+        self.assertEqual((args.predict, args.verify_prediction), ('history.jsonl', True))
+        self.assertIsNone(build_parser().parse_args(['merge']).predict)
+
+    def test_parser_does_not_import_pillow(self):
+        code = "import sys, webp_cli; webp_cli.build_parser().parse_args(['bench']); print('PIL' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), 'False')
+
+if __name__ == '__main__':
+    unittest.main()
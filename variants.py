@@ -0,0 +1,90 @@
+from PIL import Image
+from dataclasses import dataclass, asdict
+
+@dataclass(frozen=True)
+class Variant:
+    """
+    一个输出版本（同一张源图片可以一次解码后输出多个版本）
+
+    属性:
+        name: 版本名称，'full' 表示原图，其他名称作为文件名后缀（例如 a_cropped.webp）
+        crop_ratio: 中心裁剪为原图的 1/n（默认1，不裁剪）
+        width: 裁剪后缩放到的宽度（可选，保持宽高比）
+        target_kb: 目标大小，单位KB（可选，默认按参考大小的50%）
+    """
+    name: str = 'full'
+    crop_ratio: int = 1
+    width: int = None
+    target_kb: int = None
+
+    @property
+    def suffix(self):
+        return '' if self.name == 'full' else f"_{self.name}"
+
+    def output_path(self, output_file):
+        """根据原图的输出路径得到该版本的输出路径"""
+        return output_file.with_name(f"{output_file.stem}{self.suffix}.webp")
+
+    def to_dict(self):
+        return asdict(self)
+
+    def output_size(self, source_size):
+        """该版本的输出尺寸（与 render_variant 一致，不需要解码图片）"""
+        width, height = source_size
+        if self.crop_ratio > 1:
+            width, height = width // self.crop_ratio, height // self.crop_ratio
+        if self.width and self.width != width:
+            width, height = self.width, max(1, round(height * self.width / width))
+        return width, height
+
+def default_variants(create_cropped=False, crop_ratio=4, cropped_target_kb=None):
+    """与 create_cropped/crop_ratio/cropped_target_kb 参数等价的版本列表"""
+    variants = [Variant()]
+    if create_cropped:
+        variants.append(Variant('cropped', crop_ratio=crop_ratio, target_kb=cropped_target_kb))
+    return variants
+
+def parse_variant(spec):
+    """
+    解析命令行中的版本描述
+
+    格式: 名称[:crop=n,width=w,kb=k]，例如 'full'、'cropped:crop=4'、'w640:width=640,kb=40'
+    """
+    name, _, options = spec.partition(':')
+    name = name.strip()
+    if not name:
+        raise ValueError(f"版本名称不能为空: {spec}")
+
+    fields = {'crop': 'crop_ratio', 'width': 'width', 'kb': 'target_kb'}
+    values = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key.strip() not in fields:
+            raise ValueError(f"未知的版本参数 {key}（可用: crop, width, kb）")
+        try:
+            values[fields[key.strip()]] = int(value)
+        except ValueError:
+            raise ValueError(f"版本参数必须是整数: {option}")
+
+    variant = Variant(name, **values)
+    if variant.crop_ratio < 1 or (variant.width is not None and variant.width < 1):
+        raise ValueError(f"无效的版本参数: {spec}")
+    return variant
+
+def crop_center(img, crop_ratio):
+    """以中心点为基准裁剪为原图的 1/crop_ratio 大小"""
+    width, height = img.size
+    target_width = width // crop_ratio
+    target_height = height // crop_ratio
+    left = (width - target_width) // 2
+    top = (height - target_height) // 2
+    return img.crop((left, top, left + target_width, top + target_height))
+
+def render_variant(img, variant):
+    """在已解码的图片上生成该版本（裁剪、缩放），不修改原图"""
+    if variant.crop_ratio > 1:
+        img = crop_center(img, variant.crop_ratio)
+    if variant.width and variant.width != img.width:
+        height = max(1, round(img.height * variant.width / img.width))
+        img = img.resize((variant.width, height), Image.Resampling.LANCZOS)
+    return img
@@ -0,0 +1,255 @@
+import argparse
+import sys
+
+# 这里只导入标准库：Pillow、NumPy 等在子命令真正运行时才导入，
+# 显示帮助、参数有误或在脚本中频繁调用时启动都很快；命令行从不导入 tkinter
+
+def main(argv=None):
+    """命令行入口，返回退出码（有文件失败时为1）"""
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except Exception as e:
+        print(f"错误: {str(e)}")
+        return 1
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Webp 工具箱命令行",
+        epilog="1. 转换单个文件: python webp_cli.py convert input.png [output_directory]\n"
+               "2. 转换整个目录: python webp_cli.py convert input_directory [output_directory] --workers 0\n"
+               "3. 转换标准输入中的文件列表: find . -name '*.png' | python webp_cli.py convert - output_directory\n"
+               "4. 合并两张图片: python webp_cli.py merge image1.png image2.png output.webp\n"
+               "5. 按清单批量合并: python webp_cli.py merge --manifest pairs.csv --workers 8\n"
+               "6. 性能测试: python webp_cli.py bench --output baseline.json\n"
+               "7. 常驻转换服务: python webp_cli.py serve --port 8765 --workers 0",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command', metavar='{convert,merge,bench,serve}', required=True)
+    _add_convert_parser(subparsers)
+    _add_merge_parser(subparsers)
+    _add_bench_parser(subparsers)
+    _add_serve_parser(subparsers)
+    return parser
+
+def _add_convert_parser(subparsers):
+    parser = subparsers.add_parser(
+        'convert', help="PNG转WEBP",
+        description="PNG转WEBP。输入为 - 时从标准输入逐行读取PNG文件路径，在同一个进程中批量转换",
+        epilog="1. 转换单个文件: convert input.png [output_directory]\n"
+               "2. 转换整个目录: convert input_directory [output_directory] [--workers N] [--recursive]\n"
+               "3. 持续监视目录: convert input_directory [output_directory] --watch\n"
+               "4. 文件列表: find . -name '*.png' -print0 | convert - output_directory --null\n"
+               "5. 可中断的大批量转换: convert input_directory output_directory --journal run.journal",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('input_path', help="输入PNG文件或目录，- 表示从标准输入读取文件列表")
+    parser.add_argument('output_path', nargs='?', default=None, help="输出目录（可选）")
+    parser.add_argument('--null', '-0', action='store_true', help="标准输入中的文件路径以NUL分隔（配合 find -print0）")
+    parser.add_argument('--min-quality', type=int, default=80, help="最低质量（默认80，范围0-100）")
+    parser.add_argument('--no-cropped', action='store_true', help="不创建中心裁剪版本")
+    parser.add_argument('--crop-ratio', type=int, default=4, help="中心裁剪版本为原图的 1/n（默认4）")
+    parser.add_argument('--workers', type=int, default=1, help="批量转换的并行进程数（默认1，0表示使用全部CPU核心）")
+    parser.add_argument('--recursive', action='store_true', help="递归处理子目录")
+    parser.add_argument('--watch', action='store_true', help="持续监视目录，只转换新增或变化的文件")
+    parser.add_argument('--watch-interval', type=float, default=2.0, help="监视模式的轮询间隔，单位秒（默认2）")
+    parser.add_argument('--variant', dest='variants', action='append', type=_variant, metavar='SPEC',
+                        help="输出版本，可重复指定，格式: 名称[:crop=n,width=w,kb=k]，"
+                             "例如 --variant full --variant cropped:crop=4 --variant w640:width=640,kb=40")
+    parser.add_argument('--cropped-target-kb', type=int, default=None, help="裁剪版本的目标大小，单位KB（可选）")
+    parser.add_argument('--target-ratio', type=float, default=0.5,
+                        help="未指定目标大小的版本以源文件大小的这一比例为目标（默认0.5）")
+    parser.add_argument('--max-trials', type=int, default=None, help="每个版本的试编码次数上限（可选）")
+    parser.add_argument('--min-scale', type=float, default=1.0,
+                        help="最低质量仍超出目标大小时允许缩小到的比例（默认1，不缩小）")
+    parser.add_argument('--target-ssim', dest='target_score', type=float, default=None,
+                        help="按感知质量查找：选择与源图片的SSIM达到该值的最小文件（例如0.98，需要NumPy）")
+    parser.add_argument('--encoding', choices=('lossy', 'auto'), default='lossy',
+                        help="编码方式（默认lossy）。auto 按图片内容选择无损、近无损或有损编码，适合界面截图、示意图较多的图片")
+    parser.add_argument('--search-threads', type=int, default=1,
+                        help="单张图片质量搜索的并行线程数（默认1）。3个线程每轮前进2层二分，7个线程3层，"
+                             "其他线程数时多出的线程预先编码下一层的一部分")
+    parser.add_argument('--cache', dest='cache_dir', default=None, help="转换缓存目录，未变化的文件直接跳过")
+    parser.add_argument('--cache-max-mb', type=int, default=1024, help="转换缓存的最大容量，单位MB（默认1024）")
+    parser.add_argument('--predict', nargs='?', const='', default=None, metavar='HISTORY_FILE',
+                        help="根据历史结果预测质量参数以减少编码次数（可指定历史记录文件）")
+    parser.add_argument('--verify-prediction', action='store_true', help="同时运行完整二分查找，检查预测查找的结果")
+    parser.add_argument('--metrics', dest='metrics_file', default=None, metavar='FILE',
+                        help="把每个文件的转换记录（耗时、编码次数、大小、质量）追加到JSONL文件")
+    parser.add_argument('--quiet', action='store_true', help="不输出每个文件的结果，只输出失败信息和汇总")
+    parser.add_argument('--max-memory-mb', type=int, default=None, help="批量转换的内存预算，单位MB（可选）")
+    parser.add_argument('--journal', dest='journal_file', default=None, metavar='FILE',
+                        help="批量转换日志文件，中断后用同样的命令再次运行时跳过已完成的文件")
+    parser.set_defaults(handler=_convert)
+
+def _add_merge_parser(subparsers):
+    parser = subparsers.add_parser(
+        'merge', help="图片合并",
+        description="把两张图片合并为中间用斜线分割的对比图",
+        epilog="1. 合并两张图片: merge image1.png image2.png output.webp\n"
+               "2. 按清单批量合并: merge --manifest pairs.csv --workers 8\n"
+               "3. 从标准输入读取清单: merge --manifest - < pairs.csv",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('image1', nargs='?', default='image1.png', help="第一张图片（左侧）")
+    parser.add_argument('image2', nargs='?', default='image2.png', help="第二张图片（右侧）")
+    parser.add_argument('output', nargs='?', default='output.webp', help="输出WEBP文件")
+    parser.add_argument('--width', type=int, default=960, help="输出宽度（默认960）")
+    parser.add_argument('--target-kb', type=int, default=35, help="目标大小，单位KB（默认35）")
+    parser.add_argument('--prescale', action='store_true', help="先缩放到输出尺寸再合成（更快，有少量误差）")
+    parser.add_argument('--manifest', help="批量合并清单（CSV或JSONL: left,right,output,width,target_kb），- 表示标准输入")
+    parser.add_argument('--workers', type=int, default=1, help="批量合并的并行进程数（默认1，0表示使用全部CPU核心）")
+    parser.add_argument('--report', help="批量合并时每行耗时和错误的报告文件（JSONL）")
+    parser.add_argument('--max-trials', type=int, default=None, help="每张图片的试编码次数上限（可选）")
+    parser.add_argument('--low-memory', action='store_true',
+                        help="逐张解码并立即缩小到输出尺寸，降低超大图片的内存占用（同时启用 --prescale）")
+    parser.add_argument('--max-memory-mb', type=int, default=None, help="批量合并的内存预算，单位MB（可选）")
+    parser.add_argument('--min-scale', type=float, default=1.0,
+                        help="最低质量仍超出目标大小时允许缩小到的比例（默认1，不缩小）")
+    parser.add_argument('--predict', nargs='?', const='', default=None, metavar='HISTORY_FILE',
+                        help="根据历史结果预测质量参数以减少编码次数（可指定历史记录文件）")
+    parser.add_argument('--verify-prediction', action='store_true', help="同时运行完整二分查找，检查预测查找的结果")
+    parser.set_defaults(handler=_merge)
+
+def _add_bench_parser(subparsers):
+    parser = subparsers.add_parser(
+        'bench', help="转换和合并的性能测试",
+        description="转换和合并的性能测试",
+        epilog="1. 运行并保存基准: bench --output baseline.json\n"
+               "2. 与基准比较: bench --baseline baseline.json",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--sizes', nargs='+', default=['960x540', '1920x1080'],
+                        help="图片尺寸，例如 960x540 3840x2160")
+    parser.add_argument('--count', type=int, default=1, help="每种图片、每种尺寸生成的数量（默认1）")
+    parser.add_argument('--cases', nargs='+', default=None, metavar='CASE',
+                        help=_CasesHelp("要运行的测试项（默认全部: %(cases)s）"))
+    parser.add_argument('--repeat', type=int, default=3, help="每个测试项的运行次数，取中位数（默认3）")
+    parser.add_argument('--workers', type=int, default=0, help="batch 测试项的并行进程数（默认0，使用全部CPU核心）")
+    parser.add_argument('--corpus-dir', default=None, help="保存合成图片的目录（可选，已存在的图片直接复用）")
+    parser.add_argument('--output', default=None, help="把结果保存为JSON文件")
+    parser.add_argument('--baseline', default=None, help="与之比较的基准JSON文件")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="允许的耗时增加比例（默认0.1）")
+    parser.set_defaults(handler=_bench)
+
+def _add_serve_parser(subparsers):
+    parser = subparsers.add_parser(
+        'serve', help="常驻转换服务（本机HTTP接口）",
+        description="在本机HTTP接口上提供转换和合并，作业在预热过的常驻进程池中执行",
+        epilog="1. 提交转换: curl -d '{\"input_path\": \"a.png\", \"job_id\": \"upload-1\"}' "
+               "'http://127.0.0.1:8765/convert?wait=60'\n"
+               "2. 查询作业: curl http://127.0.0.1:8765/jobs/upload-1\n"
+               "3. 健康检查和指标: curl http://127.0.0.1:8765/health, curl http://127.0.0.1:8765/metrics",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址（默认127.0.0.1，只接受本机连接）")
+    parser.add_argument('--port', type=int, default=8765, help="监听端口（默认8765，0表示由系统分配）")
+    parser.add_argument('--workers', type=int, default=0, help="工作进程数（默认0，使用全部CPU核心）")
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help="除正在执行的作业外最多排队的作业数，超出时返回429（默认64）")
+    parser.add_argument('--max-finished', type=int, default=1000, help="保留供查询的已结束作业数（默认1000）")
+    parser.add_argument('--quiet', action='store_true', help="不输出每个请求的访问日志")
+    parser.set_defaults(handler=_serve)
+
+class _CasesHelp(str):
+    """--cases 的帮助文字：显示帮助时才导入 benchmark（会导入Pillow），列出 benchmark.CASES 中的测试项"""
+
+    def __mod__(self, params):
+        from benchmark import CASES
+        return str.__mod__(self, dict(params, cases=' '.join(CASES)))
+
+def _variant(spec):
+    # 只有指定 --variant 时才导入 variants（会导入Pillow）
+    from variants import parse_variant
+    try:
+        return parse_variant(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def _stdin_paths(null=False):
+    """从标准输入逐个产出文件路径（边读边产出，跳过空行）"""
+    if null:
+        for path in sys.stdin.read().split('\0'):
+            if path:
+                yield path
+    else:
+        for line in sys.stdin:
+            path = line.rstrip('\r\n')
+            if path.strip():
+                yield path
+
+def _predictor(args):
+    """--predict、--verify-prediction 对应的 QualityPredictor，都未指定时返回None"""
+    if args.predict is None and not args.verify_prediction:
+        return None
+    from quality_predictor import QualityPredictor
+    return QualityPredictor(args.predict or None, verify=args.verify_prediction)
+
+def _convert(args):
+    from png_to_webp import convert_png_to_webp
+
+    if args.input_path == '-' and args.watch:
+        raise Exception("从标准输入读取文件列表时不能使用 --watch")
+
+    predictor = _predictor(args)
+
+    input_path = _stdin_paths(args.null) if args.input_path == '-' else args.input_path
+    records = convert_png_to_webp(input_path, args.output_path, args.min_quality, create_cropped=not args.no_cropped,
+                                  crop_ratio=args.crop_ratio, workers=args.workers or None,
+                                  search_threads=args.search_threads, cache_dir=args.cache_dir,
+                                  cache_max_mb=args.cache_max_mb, predictor=predictor, recursive=args.recursive,
+                                  watch=args.watch, watch_interval=args.watch_interval,
+                                  cropped_target_kb=args.cropped_target_kb, variants=args.variants,
+                                  metrics_file=args.metrics_file, quiet=args.quiet, target_ratio=args.target_ratio,
+                                  max_trials=args.max_trials, min_scale=args.min_scale,
+                                  max_memory_mb=args.max_memory_mb, target_score=args.target_score,
+                                  journal_file=args.journal_file, encoding=args.encoding)
+    return 1 if any(record.error for record in records) else 0
+
+def _merge(args):
+    from merge_images import merge_batch, merge_images
+
+    predictor = _predictor(args)
+    if args.manifest:
+        results = merge_batch(args.manifest, args.workers or None, args.prescale, args.report, args.max_trials,
+                              args.min_scale, args.low_memory, args.max_memory_mb, predictor)
+        return 1 if any(result['error'] for result in results) else 0
+
+    rate = merge_images(args.image1, args.image2, args.output, args.width, args.target_kb, predictor,
+                        prescale=args.prescale, max_trials=args.max_trials, min_scale=args.min_scale,
+                        low_memory=args.low_memory)
+    print(f"合并完成: {args.output} ({rate.bytes_out/1024:.1f}KB, 质量 {rate.quality}, "
+          f"与目标大小的偏差 {rate.deviation * 100:+.1f}%, 试编码 {len(rate.trials)} 次)")
+    return 0
+
+def _bench(args):
+    import json
+    from benchmark import CASES, compare_to_baseline, parse_size, run_benchmark
+
+    cases = args.cases or list(CASES)
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        raise Exception(f"未知的测试项: {', '.join(unknown)}（可用: {', '.join(CASES)}）")
+
+    results = run_benchmark([parse_size(size) for size in args.sizes], cases, args.repeat, args.workers or None,
+                            args.corpus_dir, args.count)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for case, reason in regressions:
+            print(f"性能回归 {case}: {reason}")
+        if regressions:
+            return 1
+    return 0
+
+def _serve(args):
+    from conversion_service import serve
+
+    serve(args.host, args.port, args.workers or None, args.queue_size, args.max_finished, args.quiet)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+import io
+import os
+import re
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 最佳压缩方法
+WEBP_METHOD = 6
+
+# 中断的写入留下的WEBP临时文件：write_atomic 的 <输出文件名>.<随机字符>.temp，
+# 以及早期版本的 <输出文件名>.temp 和 <输出文件名>.temp.png
+TEMP_FILE_PATTERN = re.compile(r'.+\.webp(\.[A-Za-z0-9_]+)?\.temp(\.png)?')
+
+# 当前进程的 umask，原子写入时用来恢复普通文件的默认权限
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def encode_webp(img, quality, method=WEBP_METHOD, lossless=False):
+    """将图片编码为WEBP，返回内存中的字节（memoryview，不落盘）"""
+    buffer = io.BytesIO()
+    img.save(buffer, 'WEBP', quality=quality, method=method, lossless=lossless)
+    return buffer.getbuffer()
+
+def search_quality(img, quality_min, quality_max, fits, keep='smallest', method=WEBP_METHOD, lossless=False,
+                   threads=1, max_trials=None):
+    """
+    在内存中二分查找质量参数，只保留最佳候选的编码结果
+
+    参数:
+        img: 要编码的图片
+        quality_min: 最低质量
+        quality_max: 最高质量
+        fits: 判断编码大小（字节）是否满足要求的函数，满足时向更高质量查找
+        keep: 候选保留策略（见 best_trial）
+              'smallest' - 保留体积最小的试编码
+              'fitting'  - 保留满足要求的最高质量，全部不满足时保留最低质量
+        threads: 并行试编码的线程数。大于1时每轮按二分查找树逐层预先编码 threads 个质量参数
+                 （同一层从较低的质量开始），再沿串行二分的路径取结果，因此最终结果与串行二分完全一致。
+                 3个线程一轮前进2层，7个线程3层；其他线程数时多出的线程预先编码下一层的一部分，
+                 路径走到已编码的节点时本轮多前进一层（例如2个线程平均每轮约1.5层）
+        max_trials: 试编码次数上限（可选），用完时从已有的试编码中选择。指定时不预先编码（推测编码也是编码）
+
+    返回:
+        (最佳质量参数, 最佳编码字节, 试编码记录[(质量, 大小), ...])
+    """
+    best_quality = None
+    best_data = None
+    trials = []
+
+    def searching():
+        return quality_min <= quality_max and (max_trials is None or len(trials) < max_trials)
+
+    frontier = 1 if max_trials is not None else max(1, threads)
+    executor = None
+    if frontier > 1:
+        img.load()
+        executor = ThreadPoolExecutor(max_workers=threads)
+
+    try:
+        while searching():
+            # 预先编码本轮可能走到的质量参数（WEBP编码时会释放GIL）
+            qualities = _bisection_frontier(quality_min, quality_max, frontier)
+            if executor is None:
+                encoded = {q: encode_webp(img, q, method, lossless) for q in qualities}
+            else:
+                # save() 会在图片对象上写入 encoderinfo，每个线程使用共享像素数据的独立包装对象
+                encoded = dict(zip(qualities, executor.map(
+                    lambda q: encode_webp(img._new(img.im), q, method, lossless), qualities)))
+
+            # 沿串行二分的路径前进，直到下一个质量未预先编码；未走到的推测编码直接丢弃
+            while searching() and (quality_min + quality_max) // 2 in encoded:
+                current_quality = (quality_min + quality_max) // 2
+                data = encoded[current_quality]
+                trials.append((current_quality, len(data)))
+
+                # 与其他查找方式按同一规则选择，只保留当前最佳候选的编码结果
+                if best_trial(trials, fits, keep) == current_quality:
+                    best_quality = current_quality
+                    best_data = data
+
+                # 调整搜索范围
+                if fits(len(data)):
+                    quality_min = current_quality + 1
+                else:
+                    quality_max = current_quality - 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return best_quality, best_data, trials
+
+def best_trial(trials, fits, keep='smallest'):
+    """
+    按候选保留策略从试编码记录 [(质量, 大小), ...] 中选出最终的质量参数
+
+    search_quality 按这一规则从二分路径上的试编码中选择；插值和预测查找在 max_trials 用完、
+    还没有确定边界时也按这一规则从已有的试编码中选择（确定边界后见 bisection_choice）。
+    'smallest' 为体积最小的试编码（大小相同时取最早的一个），
+    'fitting' 为满足要求的最高质量，全部不满足时为最低质量。
+    """
+    if keep == 'smallest':
+        return min(trials, key=lambda trial: trial[1])[0]
+    fitting = [quality for quality, size in trials if fits(size)]
+    return max(fitting) if fitting else min(quality for quality, _ in trials)
+
+def _bisection_frontier(quality_min, quality_max, count):
+    """按层（同一层从较低的质量开始）返回二分查找树的前 count 个质量参数"""
+    qualities = []
+    ranges = deque([(quality_min, quality_max)])
+    while ranges and len(qualities) < count:
+        low, high = ranges.popleft()
+        if low > high:
+            continue
+        middle = (low + high) // 2
+        qualities.append(middle)
+        ranges.append((low, middle - 1))
+        ranges.append((middle + 1, high))
+    return qualities
+
+def search_quality_predicted(img, quality_min, quality_max, fits, predicted, keep='smallest', method=WEBP_METHOD,
+                             lossless=False, max_trials=None):
+    """
+    从预测的质量参数开始查找，预测准确时只需2-3次编码
+
+    先试编码预测的质量和相邻的质量（满足要求时试更高一级，否则试更低一级），再沿 search_quality 的
+    二分路径前进：假设编码大小随质量单调递增，能由已有试编码推出是否满足要求的节点不再编码。
+    走完路径后选择 bisection_choice 的质量（没有编码过时补充编码），结果只由二分路径决定，
+    与预测值无关；预测偏差较大时最多比二分查找多2次编码。
+    max_trials 为试编码次数上限（可选），用完时不再继续查找，按 best_trial 从已有的试编码中选择。
+
+    返回:
+        (最佳质量参数, 最佳编码字节, 试编码记录[(质量, 大小), ...])
+    """
+    if max_trials is not None:
+        max_trials = max(1, max_trials)
+    encoded = {}
+    trials = []
+    # 已知满足要求的最高质量和已知不满足的最低质量
+    low, high = quality_min - 1, quality_max + 1
+
+    def trial(quality):
+        nonlocal low, high
+        data = encode_webp(img, quality, method, lossless)
+        encoded[quality] = data
+        trials.append((quality, len(data)))
+        if fits(len(data)):
+            low = max(low, quality)
+            return True
+        high = min(high, quality)
+        return False
+
+    def exhausted():
+        return max_trials is not None and len(trials) >= max_trials
+
+    current_quality = min(max(predicted, quality_min), quality_max)
+    if trial(current_quality):
+        neighbor = current_quality + 1 if current_quality < quality_max else None
+    else:
+        neighbor = current_quality - 1 if current_quality > quality_min else None
+    if neighbor is not None and not exhausted():
+        trial(neighbor)
+
+    # 沿二分路径前进，只编码无法由已知边界推出的节点
+    path_min, path_max = quality_min, quality_max
+    while path_min <= path_max:
+        current_quality = (path_min + path_max) // 2
+        if current_quality in encoded:
+            current_fits = fits(len(encoded[current_quality]))
+        elif current_quality <= low:
+            current_fits = True
+        elif current_quality >= high:
+            current_fits = False
+        elif exhausted():
+            break
+        else:
+            current_fits = trial(current_quality)
+        if current_fits:
+            path_min = current_quality + 1
+        else:
+            path_max = current_quality - 1
+
+    if path_min > path_max:
+        best_quality = bisection_choice(quality_min, quality_max, path_min - 1, keep)
+        if best_quality not in encoded and not exhausted():
+            trial(best_quality)
+        if best_quality in encoded:
+            return best_quality, encoded[best_quality], trials
+    best_quality = best_trial(trials, fits, keep)
+    return best_quality, encoded[best_quality], trials
+
+def bisection_choice(quality_min, quality_max, boundary, keep='smallest'):
+    """
+    推算 search_quality 在给定边界下选中的质量参数（不编码）
+
+    boundary 为满足要求的最高质量，全部不满足时为 quality_min - 1。
+    假设编码大小随质量单调递增，'smallest' 策略选中的就是路径上质量最低的试编码。
+    插值和预测查找确定边界后都返回这个质量（没有编码过时补充编码），结果与查找路径无关。
+    """
+    if keep != 'smallest':
+        return max(boundary, quality_min)
+
+    path = []
+    while quality_min <= quality_max:
+        current_quality = (quality_min + quality_max) // 2
+        path.append(current_quality)
+        if current_quality <= boundary:
+            quality_min = current_quality + 1
+        else:
+            quality_max = current_quality - 1
+    return min(path)
+
+def quality_boundary(trials, fits, quality_min):
+    """根据试编码记录求满足要求的最高质量，全部不满足时返回 quality_min - 1"""
+    return max((quality for quality, size in trials if fits(size)), default=quality_min - 1)
+
+def write_atomic(output_file, data, fsync=False):
+    """一次性写入最终文件：先写同目录临时文件，再原子替换（fsync 为True时替换前先写入磁盘）"""
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, temp_output = tempfile.mkstemp(dir=output_file.parent, prefix=output_file.name + '.', suffix='.temp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp 创建的文件只有所有者可读写，改为与直接保存时相同的权限
+        os.chmod(temp_output, 0o666 & ~_UMASK)
+        os.replace(temp_output, output_file)
+    except Exception:
+        if os.path.exists(temp_output):
+            os.remove(temp_output)
+        raise
+
+def remove_temp_files(directory, recursive=False):
+    """删除目录中中断的写入留下的WEBP临时文件（见 TEMP_FILE_PATTERN），返回删除的文件数"""
+    removed = 0
+    pending_dirs = [directory]
+    while pending_dirs:
+        try:
+            with os.scandir(pending_dirs.pop()) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_file() and TEMP_FILE_PATTERN.fullmatch(entry.name):
+                    os.remove(entry.path)
+                    removed += 1
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+            except OSError:
+                continue
+    return removed
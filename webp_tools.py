@@ -3,9 +3,11 @@ from tkinter import ttk, filedialog, messagebox
 from pathlib import Path
 import os
 import json
+import multiprocessing
 
+from background_jobs import JobEngine
 from merge_images import merge_images
-from png_to_webp import convert_png_to_webp
+from png_to_webp import conversion_targets, convert_single_file
 
 class WebpTools:
     def __init__(self, root):
@@ -18,7 +20,7 @@ class WebpTools:
         
         # 设置窗口大小和位置
         window_width = 600
-        window_height = 400
+        window_height = 600
         screen_width = root.winfo_screenwidth()
         screen_height = root.winfo_screenheight()
         center_x = int(screen_width/2 - window_width/2)
@@ -38,6 +40,10 @@ class WebpTools:
         
         self.setup_merge_tab()
         self.setup_convert_tab()
+        self.setup_progress_area()
+        
+        # 后台作业引擎，耗时操作不在界面线程中执行
+        self.engine = JobEngine(self.root, self.on_job_event)
         
         # 关闭窗口时保存配置
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -139,6 +145,27 @@ class WebpTools:
         # 转换按钮
         ttk.Button(self.convert_frame, text="转换为WEBP", command=self.convert_to_webp).pack(pady=20)
     
+    def setup_progress_area(self):
+        # 进度条和状态
+        progress_frame = ttk.Frame(self.root)
+        progress_frame.pack(fill='x', padx=20)
+        self.progress = ttk.Progressbar(progress_frame, mode='determinate')
+        self.progress.pack(side='left', expand=True, fill='x')
+        self.cancel_button = ttk.Button(progress_frame, text="取消", command=self.cancel_job, state='disabled')
+        self.cancel_button.pack(side='right', padx=5)
+        
+        self.status = tk.StringVar(value="空闲")
+        ttk.Label(self.root, textvariable=self.status).pack(fill='x', padx=20, pady=5)
+        
+        # 每个文件的处理结果
+        results_frame = ttk.Frame(self.root)
+        results_frame.pack(fill='both', expand=True, padx=20, pady=(0, 10))
+        scrollbar = ttk.Scrollbar(results_frame)
+        scrollbar.pack(side='right', fill='y')
+        self.results = tk.Listbox(results_frame, height=8, yscrollcommand=scrollbar.set)
+        self.results.pack(side='left', fill='both', expand=True)
+        scrollbar.config(command=self.results.yview)
+    
     def select_file(self, path_var):
         filename = filedialog.askopenfilename(filetypes=[("PNG files", "*.png")])
         if filename:
@@ -174,13 +201,10 @@ class WebpTools:
             
             # 构建完整的输出路径
             output_path = Path(self.merge_output_dir.get()) / f"{self.merge_filename.get()}.webp"
+            task = (output_path.name, merge_images, (self.image1_path.get(), self.image2_path.get(), str(output_path)))
             
-            merge_images(
-                self.image1_path.get(),
-                self.image2_path.get(),
-                str(output_path)
-            )
-            messagebox.showinfo("成功", f"图片合并完成!\n保存在: {output_path}")
+            job = self.engine.submit("图片合并", lambda: [task])
+            job.success_msg = f"图片合并完成!\n保存在: {output_path}"
         except Exception as e:
             messagebox.showerror("错误", f"合并失败: {str(e)}")
     
@@ -205,28 +229,87 @@ class WebpTools:
                 messagebox.showerror("错误", "裁剪比率必须是整数!")
                 return
             
-            convert_png_to_webp(
-                self.png_path.get(),
-                self.convert_output_path.get(),
-                quality,
-                self.create_cropped.get(),
-                crop_ratio
-            )
+            input_path = self.png_path.get()
+            output_path = self.convert_output_path.get()
+            create_cropped = self.create_cropped.get()
             
-            # 构建成功消息
-            success_msg = "转换完成!"
-            if self.create_cropped.get():
-                success_msg += f"\n同时创建了中心裁剪版本 (原图的 1/{crop_ratio} 大小)"
+            def make_tasks():
+                # 在后台线程中扫描目录，大目录也不会阻塞界面
+                for input_file, output_file, cropped_output_file in conversion_targets(
+                        input_path, output_path, create_cropped):
+                    yield (input_file.name, convert_single_file,
+                           (input_file, output_file, quality, cropped_output_file, crop_ratio))
+            
+            job = self.engine.submit("PNG转WEBP", make_tasks)
             
-            messagebox.showinfo("成功", success_msg)
+            # 构建成功消息
+            job.success_msg = "转换完成!"
+            if create_cropped:
+                job.success_msg += f"\n同时创建了中心裁剪版本 (原图的 1/{crop_ratio} 大小)"
         except Exception as e:
             messagebox.showerror("错误", f"转换失败: {str(e)}")
     
+    def cancel_job(self):
+        self.engine.cancel()
+    
+    def on_job_event(self, event, job, *details):
+        if event == 'queued':
+            self.cancel_button.config(state='normal')
+            if self.engine.current is not None:
+                self.results.insert('end', f"已加入队列: {job.name}")
+        elif event == 'started':
+            self.progress.config(value=0, maximum=1)
+            self.results.insert('end', f"开始: {job.name}")
+        elif event == 'total':
+            self.progress.config(maximum=max(job.total, 1))
+        elif event == 'result':
+            name, error = details
+            self.progress.config(value=job.done)
+            self.results.insert('end', f"✗ {name}: {error}" if error else f"✓ {name}")
+            self.results.see('end')
+        elif event == 'finished':
+            self.on_job_finished(job)
+        
+        if self.engine.current is job:
+            self.update_status(job)
+    
+    def update_status(self, job):
+        total = job.total if job.total is not None else "?"
+        status = f"{job.name}: {job.done}/{total}"
+        if job.rate:
+            status += f"，{job.rate:.2f} 个/秒"
+        if job.eta is not None:
+            status += f"，剩余约 {int(job.eta) // 60}分{int(job.eta) % 60}秒"
+        if job.errors:
+            status += f"，{job.errors}个失败"
+        queued = len(self.engine.pending_jobs)
+        if queued:
+            status += f"（队列中还有{queued}个作业）"
+        self.status.set(status)
+    
+    def on_job_finished(self, job):
+        if not self.engine.busy:
+            self.cancel_button.config(state='disabled')
+            self.status.set("空闲")
+        
+        if job.cancelled:
+            self.results.insert('end', f"已取消: {job.name}（完成 {job.done} 个）")
+        elif job.error:
+            messagebox.showerror("错误", f"{job.name}失败: {job.error}")
+        elif job.errors:
+            messagebox.showwarning("完成", f"{job.name}完成: {job.done - job.errors}个成功, {job.errors}个失败")
+        elif job.done:
+            messagebox.showinfo("成功", job.success_msg)
+        self.results.see('end')
+    
     def on_closing(self):
+        self.engine.shutdown()
         self.save_config()
         self.root.destroy()
 
 if __name__ == "__main__":
+    # 打包为可执行文件后，进程池的子进程需要这一步
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = WebpTools(root)
     root.mainloop() 
\ No newline at end of file